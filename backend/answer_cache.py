@@ -0,0 +1,137 @@
+"""
+In-memory cache of generated answers, matched by question similarity.
+
+An answer is reused for a new question about the same repository when the two
+question embeddings are within a cosine-similarity threshold and retrieval for
+the new question returned exactly the chunks the cached answer was generated
+from. Entries are tied to the commit the repository was indexed at and are
+dropped as soon as a lookup sees a different commit.
+"""
+
+import logging
+from collections import OrderedDict
+from threading import Lock
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+ANSWER_CACHE_SIMILARITY = 0.95  # Minimum cosine similarity of the two questions
+ANSWER_CACHE_MAX_ENTRIES = 256  # Answers kept per repository, least recent dropped
+REPLAY_PIECE_CHARS = 64  # Characters per streamed piece of a replayed answer
+
+
+class CachedAnswer:
+    def __init__(self, embedding, chunk_ids, chat_model, answer):
+        self.embedding = embedding
+        self.chunk_ids = chunk_ids
+        self.chat_model = chat_model
+        self.answer = answer
+
+
+class AnswerCache:
+    """
+    Answers per repository URL, valid for one indexed commit at a time.
+
+    Args:
+        similarity (float): Minimum cosine similarity between question embeddings.
+        max_entries (int): Answers kept per repository.
+    """
+
+    def __init__(
+        self, similarity=ANSWER_CACHE_SIMILARITY, max_entries=ANSWER_CACHE_MAX_ENTRIES
+    ):
+        self.similarity = similarity
+        self.max_entries = max_entries
+        self.lock = Lock()
+        self._repos = {}  # repo_url -> (commit, OrderedDict of CachedAnswer)
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+    @staticmethod
+    def _normalize(embedding):
+        embedding = np.asarray(embedding, dtype=np.float32)
+        norm = np.linalg.norm(embedding)
+        return embedding / norm if norm else embedding
+
+    def _entries(self, repo_url, commit):
+        """Entries of repo_url at commit, dropping those of any other commit."""
+        cached_commit, entries = self._repos.get(repo_url, (None, None))
+        if entries is not None and cached_commit != commit:
+            logger.info(
+                f"Dropping {len(entries)} cached answers of {repo_url}: "
+                f"indexed commit changed"
+            )
+            self.invalidations += 1
+            entries = None
+        if entries is None:
+            entries = OrderedDict()
+            self._repos[repo_url] = (commit, entries)
+        return entries
+
+    def lookup(self, repo_url, commit, chat_model, embedding, chunk_ids):
+        """
+        Return a cached answer for a question, or None.
+
+        Args:
+            repo_url (str): Repository the question is about.
+            commit (str): Commit the repository's index was built at.
+            chat_model (str): Model that would generate the answer.
+            embedding (array-like): Embedding of the question.
+            chunk_ids (list): Ids of the chunks retrieved for the question.
+
+        Returns:
+            str: The answer of the most similar cached question, or None.
+        """
+        if commit is None:
+            return None
+        query = self._normalize(embedding)
+        chunk_ids = frozenset(chunk_ids)
+        with self.lock:
+            entries = self._entries(repo_url, commit)
+            best_key, best_similarity = None, self.similarity
+            for key, entry in entries.items():
+                if entry.chunk_ids != chunk_ids or entry.chat_model != chat_model:
+                    continue
+                similarity = float(np.dot(entry.embedding, query))
+                if similarity >= best_similarity:
+                    best_key, best_similarity = key, similarity
+            if best_key is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            entries.move_to_end(best_key)
+            return entries[best_key].answer
+
+    def store(self, repo_url, commit, chat_model, embedding, chunk_ids, answer):
+        """Cache a completed answer; ignored when the commit is unknown."""
+        if commit is None or not answer:
+            return
+        entry = CachedAnswer(
+            self._normalize(embedding), frozenset(chunk_ids), chat_model, answer
+        )
+        with self.lock:
+            entries = self._entries(repo_url, commit)
+            key = object()
+            entries[key] = entry
+            while len(entries) > self.max_entries:
+                entries.popitem(last=False)
+
+    def stats(self):
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "invalidations": self.invalidations,
+                "entries": sum(len(entries) for _, entries in self._repos.values()),
+                "similarity": self.similarity,
+            }
+
+
+def iter_answer_pieces(answer, piece_chars=REPLAY_PIECE_CHARS):
+    """Split a cached answer into pieces so it streams like a generated one."""
+    for i in range(0, len(answer), piece_chars):
+        yield answer[i : i + piece_chars]
@@ -0,0 +1,528 @@
+import bisect
+import concurrent.futures
+import logging
+import multiprocessing
+import os
+import re
+from threading import Lock
+from typing import NamedTuple, Optional
+
+import tiktoken
+
+logger = logging.getLogger(__name__)
+
+# Initialize tokenizer
+tokenizer = tiktoken.get_encoding("cl100k_base")
+
+CHUNK_TARGET_TOKENS = 1024  # Tokens per chunk
+CHUNK_OVERLAP_TOKENS = 128  # Tokens shared between consecutive chunks of a file
+
+# Bump whenever the chunkers start producing different chunk texts; it is part
+# of the embedding cache key
+CHUNKER_VERSION = "v2"
+
+# tokens: fixed-size token windows
+# syntax: one chunk per function/class/method, using the tree-sitter parsers of
+#         generate_tree.py; files in other languages fall back to tokens
+CHUNKING_MODES = ("tokens", "syntax")
+DEFAULT_CHUNKING_MODE = "syntax"
+
+# Worker processes for chunking large file sets; tokenization holds the GIL
+CHUNK_PROCESS_WORKERS = os.cpu_count() or 1
+CHUNK_FILES_PER_BATCH = 64  # Files sent to a worker per task
+
+
+class CodeChunk(NamedTuple):
+    """
+    A slice of a source file. Indexing stays compatible with the old
+    (file_path, text) tuples: chunk[0] is the path and chunk[1] the text.
+    """
+
+    file_path: str
+    text: str
+    start_char: int  # Offset into the file, inclusive
+    end_char: int  # Offset into the file, exclusive
+    start_line: int  # 1-based, inclusive
+    end_line: int  # 1-based, inclusive
+    symbol: Optional[str] = None  # Qualified name(s) of the definitions covered
+
+
+def line_starts(content):
+    """Character offsets at which each line of content begins."""
+    return [0] + [match.end() for match in re.finditer("\n", content)]
+
+
+def chunk_text_by_tokens(
+    file_path,
+    content,
+    target_tokens=CHUNK_TARGET_TOKENS,
+    overlap_tokens=CHUNK_OVERLAP_TOKENS,
+    snap_to_lines=True,
+):
+    """
+    Split content into chunks of about target_tokens tokens.
+
+    The text is tokenized once; chunk boundaries are picked on the token offsets
+    and mapped back to character ranges, so the cost is linear in the file size.
+
+    Args:
+        file_path (str): Path recorded on every chunk.
+        content (str): Text to split.
+        target_tokens (int): Maximum tokens per chunk.
+        overlap_tokens (int): Tokens repeated at the start of the next chunk.
+        snap_to_lines (bool): Prefer cutting at line ends, as long as at least
+            half of the chunk is kept.
+
+    Returns:
+        list: CodeChunk objects, skipping whitespace-only ones.
+    """
+    if overlap_tokens >= target_tokens:
+        raise ValueError("overlap_tokens must be smaller than target_tokens")
+
+    tokens = tokenizer.encode_ordinary(content)
+    if not tokens:
+        return []
+    # offsets[i] is the character at which token i starts
+    _, offsets = tokenizer.decode_with_offsets(tokens)
+    lines = line_starts(content)
+
+    chunks = []
+    start_char = 0
+    while start_char < len(content):
+        start_token = bisect.bisect_right(offsets, start_char) - 1
+        end_token = start_token + target_tokens
+        if end_token >= len(tokens):
+            end_char = len(content)
+        else:
+            end_char = offsets[end_token]
+            if snap_to_lines:
+                cut = content.rfind("\n", start_char, end_char)
+                if cut - start_char >= (end_char - start_char) // 2:
+                    end_char = cut + 1
+
+        text = content[start_char:end_char]
+        if text.strip():  # Avoid adding empty chunks
+            chunks.append(
+                CodeChunk(
+                    file_path=file_path,
+                    text=text,
+                    start_char=start_char,
+                    end_char=end_char,
+                    start_line=bisect.bisect_right(lines, start_char),
+                    end_line=bisect.bisect_right(lines, end_char - 1),
+                )
+            )
+        if end_char >= len(content):
+            break
+
+        next_start = end_char
+        if overlap_tokens:
+            last_token = bisect.bisect_right(offsets, end_char - 1) - 1
+            overlap_token = max(last_token - overlap_tokens + 1, start_token + 1)
+            next_start = max(offsets[overlap_token], start_char + 1)
+            if snap_to_lines and next_start > 0 and content[next_start - 1] != "\n":
+                # Start the overlap at the next full line, if there is one
+                newline = content.find("\n", next_start, end_char)
+                if newline != -1:
+                    next_start = newline + 1
+            next_start = min(next_start, end_char)
+        start_char = next_start
+
+    return chunks
+
+
+# Node types that start a chunk of their own, per tree-sitter language
+DEFINITION_TYPES = {
+    "python": {"function_definition", "class_definition", "decorated_definition"},
+    "javascript": {
+        "function_declaration",
+        "generator_function_declaration",
+        "class_declaration",
+        "method_definition",
+        "export_statement",
+        "lexical_declaration",
+        "variable_declaration",
+    },
+    "cpp": {
+        "function_definition",
+        "class_specifier",
+        "struct_specifier",
+        "namespace_definition",
+        "template_declaration",
+    },
+}
+
+# Values that make a JavaScript `const x = ...` declaration a definition
+JS_FUNCTION_VALUES = {"arrow_function", "function", "function_expression", "class"}
+
+_language_map = None
+_language_map_error = None
+_language_map_lock = Lock()
+
+
+def load_syntax_parsers():
+    """
+    Load the tree-sitter languages of generate_tree.py once per process.
+
+    Returns:
+        dict: Language name to tree_sitter.Language, or None if the parsers can't
+        be loaded here (tree_sitter or a grammar package is not installed).
+    """
+    global _language_map, _language_map_error
+    with _language_map_lock:
+        if _language_map is None and _language_map_error is None:
+            try:
+                from generate_tree import load_language_map
+
+                _language_map = load_language_map()
+            except Exception as e:
+                _language_map_error = e
+                logger.warning(
+                    f"Syntax-aware chunking unavailable, using token chunks: {e}"
+                )
+        return _language_map
+
+
+def _is_definition(node, language):
+    if node.type not in DEFINITION_TYPES[language]:
+        return False
+    if node.type in ("lexical_declaration", "variable_declaration"):
+        return any(
+            child.type == "variable_declarator"
+            and child.child_by_field_name("value") is not None
+            and child.child_by_field_name("value").type in JS_FUNCTION_VALUES
+            for child in node.named_children
+        )
+    if node.type == "export_statement":
+        return node.child_by_field_name("declaration") is not None
+    return True
+
+
+def _symbol_name(node, code_bytes):
+    """Name of a definition node, looking through decorators, exports and templates."""
+    name = node.child_by_field_name("name")
+    if name is not None:
+        return code_bytes[name.start_byte : name.end_byte].decode("utf-8", "replace")
+
+    # C++ functions: follow the declarator chain down to the identifier
+    declarator = node.child_by_field_name("declarator")
+    if declarator is not None:
+        while declarator.child_by_field_name("declarator") is not None:
+            declarator = declarator.child_by_field_name("declarator")
+        return code_bytes[declarator.start_byte : declarator.end_byte].decode(
+            "utf-8", "replace"
+        )
+
+    for field in ("definition", "declaration"):
+        inner = node.child_by_field_name(field)
+        if inner is not None:
+            return _symbol_name(inner, code_bytes)
+    for child in node.named_children:
+        if child.type == "variable_declarator" or child.type in {
+            "function_definition",
+            "class_definition",
+            "class_specifier",
+            "struct_specifier",
+            "function_declaration",
+            "class_declaration",
+        }:
+            return _symbol_name(child, code_bytes)
+    return None
+
+
+def _inner_definitions(node, language, depth=3):
+    """Definitions nested in node's body (class members, namespace contents)."""
+    found = []
+    for child in node.named_children:
+        if _is_definition(child, language):
+            found.append(child)
+        elif depth > 1:
+            found.extend(_inner_definitions(child, language, depth - 1))
+    return found
+
+
+def chunk_text_by_syntax(
+    file_path,
+    content,
+    tree,
+    language,
+    target_tokens=CHUNK_TARGET_TOKENS,
+    overlap_tokens=CHUNK_OVERLAP_TOKENS,
+):
+    """
+    Split a parsed file into one chunk per function, class or method.
+
+    Top-level definitions that fit in target_tokens become one chunk each. Larger
+    classes and namespaces are split into their members, and members that are
+    still too large are split with chunk_text_by_tokens. Code between definitions
+    (imports, statements, comments) and small neighbouring definitions are merged
+    into shared chunks up to target_tokens.
+
+    Args:
+        file_path (str): Path recorded on every chunk.
+        content (str): Text the tree was parsed from.
+        tree (tree_sitter.Tree): Parse tree of content.
+        language (str): Key of DEFINITION_TYPES.
+        target_tokens (int): Maximum tokens per chunk.
+        overlap_tokens (int): Overlap used when a definition has to be split.
+
+    Returns:
+        list: CodeChunk objects with their symbol set.
+    """
+    code_bytes = content.encode("utf-8")
+    if len(code_bytes) == len(content):
+        to_char = int
+    else:
+        # Character index of every byte offset tree-sitter may report
+        char_offsets = [0] * (len(code_bytes) + 1)
+        position = 0
+        for index, char in enumerate(content):
+            width = len(char.encode("utf-8"))
+            for _ in range(width):
+                position += 1
+                char_offsets[position] = index + 1
+
+        def to_char(byte_offset):
+            return char_offsets[byte_offset]
+
+    lines = line_starts(content)
+
+    def count_tokens(start, end):
+        return len(tokenizer.encode_ordinary(content[start:end]))
+
+    def after_line(position):
+        # Keep trailing whitespace and the newline with the node that ends the line
+        newline = content.find("\n", position)
+        if newline != -1 and not content[position:newline].strip():
+            return newline + 1
+        return position
+
+    def segments(start, end, members, scope):
+        # Partition content[start:end] into (start, end, symbol, tokens) tuples
+        result = []
+        position = start
+        for member in members:
+            member_start = max(
+                position,
+                lines[bisect.bisect_right(lines, to_char(member.start_byte)) - 1],
+            )
+            member_end = max(member_start, after_line(to_char(member.end_byte)))
+            if member_start > position:
+                result.append(
+                    (
+                        position,
+                        member_start,
+                        scope,
+                        count_tokens(position, member_start),
+                    )
+                )
+
+            name = _symbol_name(member, code_bytes)
+            symbol = f"{scope}.{name}" if scope and name else name or scope
+            tokens = count_tokens(member_start, member_end)
+            inner = (
+                _inner_definitions(member, language) if tokens > target_tokens else []
+            )
+            if inner:
+                result.extend(segments(member_start, member_end, inner, symbol))
+            else:
+                result.append((member_start, member_end, symbol, tokens))
+            position = member_end
+        if position < end:
+            result.append((position, end, scope, count_tokens(position, end)))
+        return result
+
+    def make_chunk(start, end, symbols):
+        return CodeChunk(
+            file_path=file_path,
+            text=content[start:end],
+            start_char=start,
+            end_char=end,
+            start_line=bisect.bisect_right(lines, start),
+            end_line=bisect.bisect_right(lines, end - 1),
+            symbol=", ".join(dict.fromkeys(symbols)) or None,
+        )
+
+    top_level = [
+        node for node in tree.root_node.named_children if _is_definition(node, language)
+    ]
+
+    chunks = []
+    group_start = group_end = 0
+    group_tokens = 0
+    group_symbols = []
+
+    def flush():
+        if content[group_start:group_end].strip():
+            chunks.append(make_chunk(group_start, group_end, group_symbols))
+
+    for start, end, symbol, tokens in segments(0, len(content), top_level, None):
+        if tokens > target_tokens:
+            # A short header (e.g. `class Foo:`) is split together with the body
+            if group_tokens > target_tokens // 4:
+                flush()
+                group_start = start
+                group_symbols = []
+            for chunk in chunk_text_by_tokens(
+                file_path, content[group_start:end], target_tokens, overlap_tokens
+            ):
+                chunk_start = group_start + chunk.start_char
+                chunk_end = group_start + chunk.end_char
+                symbols = group_symbols if chunk_start < start else []
+                chunks.append(
+                    make_chunk(
+                        chunk_start, chunk_end, symbols + ([symbol] if symbol else [])
+                    )
+                )
+            group_start = group_end = end
+            group_tokens = 0
+            group_symbols = []
+            continue
+
+        if group_tokens + tokens > target_tokens:
+            flush()
+            group_start = start
+            group_tokens = 0
+            group_symbols = []
+        group_end = end
+        group_tokens += tokens
+        if symbol and content[start:end].strip():
+            group_symbols.append(symbol)
+    flush()
+
+    return chunks
+
+
+def chunk_file(
+    file_path,
+    target_tokens=CHUNK_TARGET_TOKENS,
+    overlap_tokens=CHUNK_OVERLAP_TOKENS,
+    snap_to_lines=True,
+    mode=DEFAULT_CHUNKING_MODE,
+):
+    if mode not in CHUNKING_MODES:
+        raise ValueError(
+            f"Unknown chunking mode '{mode}'. Expected one of {CHUNKING_MODES}"
+        )
+
+    try:
+        with open(file_path, "r", encoding="utf-8") as f:
+            content = f.read()
+    except Exception as e:
+        logger.error(f"Error processing file {file_path}: {e}")
+        return []
+
+    if mode == "syntax":
+        language_map = load_syntax_parsers()
+        if language_map:
+            from generate_tree import detect_language
+            from tree_sitter import Parser
+
+            language = detect_language(file_path)
+            if language in language_map and language in DEFINITION_TYPES:
+                try:
+                    # Parsers aren't thread-safe, so each call gets its own
+                    parser = Parser(language_map[language])
+                    tree = parser.parse(content.encode("utf-8"))
+                    return chunk_text_by_syntax(
+                        file_path,
+                        content,
+                        tree,
+                        language,
+                        target_tokens,
+                        overlap_tokens,
+                    )
+                except Exception as e:
+                    logger.error(
+                        f"Error parsing file {file_path}, using token chunks: {e}"
+                    )
+
+    return chunk_text_by_tokens(
+        file_path, content, target_tokens, overlap_tokens, snap_to_lines
+    )
+
+
+def chunk_file_batch(
+    file_paths,
+    target_tokens=CHUNK_TARGET_TOKENS,
+    overlap_tokens=CHUNK_OVERLAP_TOKENS,
+    snap_to_lines=True,
+    mode=DEFAULT_CHUNKING_MODE,
+):
+    """Chunk several files in one worker task."""
+    chunks = []
+    for file_path in file_paths:
+        chunks.extend(
+            chunk_file(file_path, target_tokens, overlap_tokens, snap_to_lines, mode)
+        )
+    return chunks
+
+
+_process_pool = None
+_process_pool_lock = Lock()
+
+
+def get_process_pool():
+    """
+    Process pool shared by every chunking call. Workers are spawned rather than
+    forked, since the servers fork from processes with running threads.
+    """
+    global _process_pool
+    with _process_pool_lock:
+        if _process_pool is None:
+            _process_pool = concurrent.futures.ProcessPoolExecutor(
+                max_workers=CHUNK_PROCESS_WORKERS,
+                mp_context=multiprocessing.get_context("spawn"),
+            )
+        return _process_pool
+
+
+def reset_process_pool():
+    """Drop the shared pool, e.g. after a worker crashed and broke it."""
+    global _process_pool
+    with _process_pool_lock:
+        if _process_pool is not None:
+            _process_pool.shutdown(wait=False, cancel_futures=True)
+            _process_pool = None
+
+
+def iter_chunk_batches(
+    file_paths,
+    target_tokens=CHUNK_TARGET_TOKENS,
+    overlap_tokens=CHUNK_OVERLAP_TOKENS,
+    snap_to_lines=True,
+    mode=DEFAULT_CHUNKING_MODE,
+    batch_size=CHUNK_FILES_PER_BATCH,
+):
+    """
+    Chunk files in the process pool, batch_size files per task.
+
+    In syntax mode the tree-sitter grammars are loaded here first, as
+    generate_tree.main does, so that either every worker chunks by syntax or,
+    when the grammar packages are missing, none does.
+
+    Yields:
+        tuple: (file paths, CodeChunk objects) of one batch, as soon as the batch
+        completes.
+    """
+    if mode == "syntax" and load_syntax_parsers() is None:
+        # Parsers can't be loaded here, so no worker chunks by syntax either
+        mode = "tokens"
+    pool = get_process_pool()
+    futures = {
+        pool.submit(
+            chunk_file_batch,
+            file_paths[i : i + batch_size],
+            target_tokens,
+            overlap_tokens,
+            snap_to_lines,
+            mode,
+        ): file_paths[i : i + batch_size]
+        for i in range(0, len(file_paths), batch_size)
+    }
+    try:
+        for future in concurrent.futures.as_completed(futures):
+            yield futures[future], future.result()
+    finally:
+        for future in futures:
+            future.cancel()
@@ -0,0 +1,344 @@
+import base64
+import fcntl
+import hashlib
+import logging
+import os
+import shutil
+import tempfile
+import time
+from contextlib import contextmanager
+from threading import Lock
+
+import git  # Ensure GitPython is installed: pip install GitPython
+
+logger = logging.getLogger(__name__)
+
+# full:    complete history, every blob (what `git clone` does by default)
+# shallow: only the HEAD commit (--depth 1)
+# partial: full commit/tree history, blobs fetched on demand (--filter=blob:none)
+# sparse:  shallow + partial, and only files matching the indexed extensions are checked out
+CLONE_STRATEGIES = ("full", "shallow", "partial", "sparse")
+
+# The indexing pipeline only ever reads the working tree at HEAD
+DEFAULT_CLONE_STRATEGY = "shallow"
+
+
+def sparse_patterns(extensions):
+    """Non-cone sparse-checkout patterns matching files with the given extensions."""
+    return [f"*{ext}" for ext in extensions]
+
+
+def clone_with_strategy(
+    repo_url, clone_dir, clone_strategy=DEFAULT_CLONE_STRATEGY, extensions=None
+):
+    """
+    Clone a repository using one of CLONE_STRATEGIES.
+
+    Args:
+        repo_url (str): URL to clone from (may include credentials).
+        clone_dir (str): Directory to clone into. Must not exist yet.
+        clone_strategy (str): One of CLONE_STRATEGIES.
+        extensions (tuple, optional): File extensions to check out. Required for
+            the "sparse" strategy, ignored otherwise.
+
+    Returns:
+        git.Repo: The cloned repository.
+
+    Raises:
+        ValueError: If the strategy is unknown or "sparse" is used without extensions.
+    """
+    if clone_strategy not in CLONE_STRATEGIES:
+        raise ValueError(
+            f"Unknown clone strategy '{clone_strategy}'. Expected one of {CLONE_STRATEGIES}"
+        )
+
+    logger.info(f"Cloning {clone_dir} using the '{clone_strategy}' strategy")
+
+    if clone_strategy == "full":
+        return git.Repo.clone_from(repo_url, clone_dir)
+
+    if clone_strategy == "shallow":
+        return git.Repo.clone_from(repo_url, clone_dir, depth=1, single_branch=True)
+
+    if clone_strategy == "partial":
+        return git.Repo.clone_from(
+            repo_url, clone_dir, filter="blob:none", single_branch=True
+        )
+
+    if not extensions:
+        raise ValueError("The 'sparse' clone strategy requires a list of extensions")
+
+    # Clone without a working tree, restrict it, then check out only matching blobs
+    repo = git.Repo.clone_from(
+        repo_url,
+        clone_dir,
+        depth=1,
+        single_branch=True,
+        filter="blob:none",
+        no_checkout=True,
+    )
+    repo.git.sparse_checkout("set", "--no-cone", *sparse_patterns(extensions))
+    repo.git.checkout(repo.active_branch.name)
+    return repo
+
+
+# Persistent pool of bare mirrors, shared by every clone of the same repository
+MIRROR_POOL_DIR = os.path.join(tempfile.gettempdir(), "repo_mirrors")
+MIRROR_POOL_MAX_BYTES = 20 * 1024**3  # Evict least recently used mirrors above 20 GB
+
+# Ref the remote HEAD is fetched into
+MIRROR_HEAD_REF = "refs/pool/head"
+
+
+def auth_environment(username=None, token=None):
+    """
+    Environment that makes git send HTTPS basic auth for the duration of a command,
+    so credentials never end up in a mirror's config.
+    """
+    env = {"GIT_TERMINAL_PROMPT": "0"}
+    if username and token:
+        credentials = base64.b64encode(f"{username}:{token}".encode()).decode()
+        env.update(
+            {
+                "GIT_CONFIG_COUNT": "1",
+                "GIT_CONFIG_KEY_0": "http.extraHeader",
+                "GIT_CONFIG_VALUE_0": f"Authorization: Basic {credentials}",
+            }
+        )
+    return env
+
+
+def _dir_size(path):
+    total = 0
+    for root, _, files in os.walk(path):
+        for file in files:
+            try:
+                total += os.path.getsize(os.path.join(root, file))
+            except OSError:
+                pass
+    return total
+
+
+class MirrorPool:
+    """
+    On-disk pool of bare mirrors keyed by the sha256 hash of the repository URL.
+
+    Each mirror is updated with `git fetch` and indexed through worktree checkouts,
+    so restarts and repeated clones only download new objects. A thread lock plus
+    a file lock per mirror serialize fetches; callers that queued up behind an
+    in-flight fetch reuse its result instead of fetching again. Mirrors are evicted
+    least recently used first once the pool grows past max_bytes.
+    """
+
+    def __init__(self, pool_dir=MIRROR_POOL_DIR, max_bytes=MIRROR_POOL_MAX_BYTES):
+        self.pool_dir = pool_dir
+        self.max_bytes = max_bytes
+        self._locks = {}
+        self._locks_lock = Lock()
+
+    def mirror_path(self, repo_url):
+        repo_hash = hashlib.sha256(repo_url.encode()).hexdigest()[:10]
+        return os.path.join(self.pool_dir, f"{repo_hash}.git")
+
+    def _thread_lock(self, mirror_path):
+        with self._locks_lock:
+            return self._locks.setdefault(mirror_path, Lock())
+
+    @contextmanager
+    def lock(self, repo_url):
+        """Hold the mirror exclusively across threads and processes."""
+        mirror_path = self.mirror_path(repo_url)
+        os.makedirs(self.pool_dir, exist_ok=True)
+        with self._thread_lock(mirror_path):
+            with open(f"{mirror_path}.lock", "a") as lock_file:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+                try:
+                    # The lock file's mtime doubles as the LRU timestamp
+                    os.utime(lock_file.name)
+                    yield mirror_path
+                finally:
+                    fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def fetch(
+        self,
+        repo_url,
+        clone_strategy=DEFAULT_CLONE_STRATEGY,
+        username=None,
+        token=None,
+    ):
+        """
+        Create or update the mirror of repo_url and return the remote HEAD commit.
+
+        Args:
+            repo_url (str): Public URL of the repository.
+            clone_strategy (str): One of CLONE_STRATEGIES; controls fetch depth and
+                blob filtering.
+            username (str, optional): GitHub username for private repositories.
+            token (str, optional): GitHub token for private repositories.
+
+        Returns:
+            str: Commit hash of the fetched HEAD.
+        """
+        if clone_strategy not in CLONE_STRATEGIES:
+            raise ValueError(
+                f"Unknown clone strategy '{clone_strategy}'. Expected one of {CLONE_STRATEGIES}"
+            )
+
+        requested_at = time.time()
+        with self.lock(repo_url) as mirror_path:
+            fetch_head = os.path.join(mirror_path, "FETCH_HEAD")
+            if (
+                os.path.exists(fetch_head)
+                and os.path.getmtime(fetch_head) >= requested_at
+            ):
+                # Another caller fetched while we were waiting on the lock
+                logger.info(f"Reusing concurrent fetch of {repo_url}")
+                return git.Git(mirror_path).rev_parse(MIRROR_HEAD_REF)
+
+            if not os.path.exists(mirror_path):
+                logger.info(f"Creating mirror for {repo_url} in {mirror_path}")
+                repo = git.Repo.init(mirror_path, bare=True)
+                repo.create_remote("origin", repo_url)
+                if clone_strategy in ("partial", "sparse"):
+                    with repo.config_writer() as config:
+                        config.set_value("core", "repositoryformatversion", 1)
+                        config.set_value("extensions", "partialClone", "origin")
+                        config.set_value('remote "origin"', "promisor", True)
+                        config.set_value(
+                            'remote "origin"', "partialclonefilter", "blob:none"
+                        )
+
+            # Run commands directly in the mirror: once a sparse worktree enables
+            # extensions.worktreeConfig, git.Repo no longer detects it as bare
+            mirror = git.Git(mirror_path)
+
+            fetch_kwargs = {}
+            if clone_strategy in ("shallow", "sparse"):
+                fetch_kwargs["depth"] = 1
+            elif mirror.rev_parse("--is-shallow-repository") == "true":
+                fetch_kwargs["unshallow"] = True
+
+            try:
+                logger.info(f"Fetching {repo_url} into mirror {mirror_path}")
+                with mirror.custom_environment(**auth_environment(username, token)):
+                    mirror.fetch(
+                        "origin", f"+HEAD:{MIRROR_HEAD_REF}", force=True, **fetch_kwargs
+                    )
+            except git.exc.GitCommandError as e:
+                logger.error(f"Git command failed: {e}")
+                raise e  # Re-raise exception after logging
+
+            commit = mirror.rev_parse(MIRROR_HEAD_REF)
+
+        self.evict(keep=repo_url)
+        return commit
+
+    def checkout(
+        self,
+        repo_url,
+        worktree_dir,
+        commit,
+        extensions=None,
+        username=None,
+        token=None,
+    ):
+        """
+        Check out commit into worktree_dir as a worktree of the repository's mirror.
+
+        An existing worktree is moved to the commit in place, which only touches the
+        files that differ. Passing extensions restricts the checkout to those files.
+
+        Returns:
+            str: Path to the worktree.
+        """
+        with self.lock(repo_url) as mirror_path:
+            mirror = git.Git(mirror_path)
+            env = auth_environment(username, token)
+
+            if not self._is_worktree_of(worktree_dir, mirror_path):
+                if os.path.exists(worktree_dir):
+                    logger.info(f"Replacing {worktree_dir} with a mirror worktree")
+                    shutil.rmtree(worktree_dir)
+                mirror.worktree("prune")
+                mirror.worktree(
+                    "add", "--detach", "--no-checkout", worktree_dir, commit
+                )
+
+            worktree = git.Repo(worktree_dir)
+            with worktree.git.custom_environment(**env):
+                if extensions:
+                    worktree.git.sparse_checkout(
+                        "set", "--no-cone", *sparse_patterns(extensions)
+                    )
+                worktree.git.reset("--hard", commit)
+
+        return worktree_dir
+
+    @staticmethod
+    def _is_worktree_of(worktree_dir, mirror_path):
+        dot_git = os.path.join(worktree_dir, ".git")
+        if not os.path.isfile(dot_git):
+            return False
+        with open(dot_git, "r", encoding="utf-8") as f:
+            gitdir = f.read().strip().removeprefix("gitdir: ")
+        worktrees_dir = os.path.join(os.path.realpath(mirror_path), "worktrees")
+        return os.path.realpath(gitdir).startswith(worktrees_dir + os.sep)
+
+    def evict(self, keep=None):
+        """
+        Remove least recently used mirrors, and their worktrees, until the pool fits
+        in max_bytes. Mirrors that are currently locked are skipped.
+        """
+        if not os.path.isdir(self.pool_dir):
+            return
+
+        keep_path = self.mirror_path(keep) if keep else None
+        mirrors = []
+        for entry in os.listdir(self.pool_dir):
+            path = os.path.join(self.pool_dir, entry)
+            if entry.endswith(".git") and os.path.isdir(path):
+                lock_path = f"{path}.lock"
+                last_used = (
+                    os.path.getmtime(lock_path) if os.path.exists(lock_path) else 0
+                )
+                mirrors.append((last_used, path, _dir_size(path)))
+
+        total = sum(size for _, _, size in mirrors)
+        for _, path, size in sorted(mirrors):
+            if total <= self.max_bytes:
+                break
+            if path == keep_path:
+                continue
+
+            thread_lock = self._thread_lock(path)
+            if not thread_lock.acquire(blocking=False):
+                continue
+            try:
+                with open(f"{path}.lock", "a") as lock_file:
+                    try:
+                        fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                    except BlockingIOError:
+                        continue
+                    try:
+                        self._remove_mirror(path)
+                        total -= size
+                    finally:
+                        fcntl.flock(lock_file, fcntl.LOCK_UN)
+            finally:
+                thread_lock.release()
+
+    @staticmethod
+    def _remove_mirror(mirror_path):
+        worktrees_dir = os.path.join(mirror_path, "worktrees")
+        if os.path.isdir(worktrees_dir):
+            for name in os.listdir(worktrees_dir):
+                gitdir_file = os.path.join(worktrees_dir, name, "gitdir")
+                try:
+                    with open(gitdir_file, "r", encoding="utf-8") as f:
+                        worktree_dir = os.path.dirname(f.read().strip())
+                except OSError:
+                    continue
+                shutil.rmtree(worktree_dir, ignore_errors=True)
+
+        logger.info(f"Evicting mirror {mirror_path}")
+        shutil.rmtree(mirror_path, ignore_errors=True)
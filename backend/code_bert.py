@@ -1,21 +1,35 @@
 import concurrent.futures
 import hashlib
+import itertools
 import json
 import os
 import re
 import shutil
-import sqlite3
 import time
+from collections import OrderedDict
+from threading import Event, Lock, Thread
 
 import faiss
 import git
 import numpy as np
 import torch
+from embedding_cache import load_embedding_cache, lookup_embeddings, store_embeddings
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse, StreamingResponse
+from path_index import PathIndex, describe_scope, parse_scoped_question
 from pydantic import BaseModel
+from starlette.concurrency import run_in_threadpool
 from tenacity import retry, stop_after_attempt, wait_random_exponential
-from transformers import AutoModel, AutoModelForCausalLM, AutoTokenizer
+from transformers import (
+    AutoModel,
+    AutoModelForCausalLM,
+    AutoTokenizer,
+    StoppingCriteria,
+    StoppingCriteriaList,
+    TextIteratorStreamer,
+)
+from vector_index import search_ids
 
 origins = ["*"]
 
@@ -47,87 +61,332 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-# Initialize CodeBERT tokenizer and model
-tokenizer = AutoTokenizer.from_pretrained("microsoft/codebert-base")
-model = AutoModel.from_pretrained("microsoft/codebert-base")
-model.to("cpu")  # Use 'cuda' if available
+# Intra-op threads used by CPU inference
+TORCH_NUM_THREADS = os.cpu_count() or 1
+torch.set_num_threads(TORCH_NUM_THREADS)
+
+# CodeBERT embedding model
+CODEBERT_MODEL_NAME = "microsoft/codebert-base"
+CODEBERT_MAX_LENGTH = 512  # Tokens per input, including special tokens
+EMBEDDING_BATCH_SIZE = 32  # Inputs per forward pass
+
+# torch: fp32 PyTorch model
+# onnx:  int8-quantized ONNX Runtime model (see codebert_onnx.py), exported on
+#        first use; faster and smaller on CPU
+EMBEDDING_BACKENDS = ("torch", "onnx")
+EMBEDDING_BACKEND = "torch"
+
+# GPT-J chat model
+CHAT_MODEL_NAME = "EleutherAI/gpt-j-6B"
+# float32: ~24 GB of weights
+# bfloat16: ~12 GB, loaded straight to bf16
+# int8: ~6 GB of Linear weights, dynamically quantized after a float32 load, so
+#       the load itself still peaks at the float32 size
+CHAT_MODEL_DTYPES = ("float32", "bfloat16", "int8")
+CHAT_MODEL_DTYPE = "bfloat16"
+
+# Models are loaded on first use, or in the background right after startup when
+# MODEL_WARMUP is set; /ready reports when they are loaded
+MODEL_WARMUP = True
+# Repository indexed in the background at startup; None to skip
+WARMUP_REPO_URL = "https://github.com/kavjeydev/bitwise-longest-repeating.git"
+
+tokenizer = None
+model = None
+onnx_embedder = None
+embedding_dimension = None
+embedding_cache_model = None  # Embedding cache namespace of the loaded model
+chat_tokenizer = None
+chat_model = None
+
+tokenizer_lock = Lock()
+embedding_model_lock = Lock()
+chat_model_lock = Lock()
+# Model from_pretrained calls switch torch's global default dtype while they
+# load, so they run one at a time; everything else loads concurrently
+from_pretrained_lock = Lock()
+model_status = {"embedding": "not loaded", "chat": "not loaded"}
+
+
+def load_tokenizer():
+    """Load the CodeBERT tokenizer, which chunking needs before any embedding."""
+    global tokenizer
+    with tokenizer_lock:
+        if tokenizer is None:
+            tokenizer = AutoTokenizer.from_pretrained(CODEBERT_MODEL_NAME)
+    return tokenizer
+
+
+def load_embedding_model():
+    """Load the CodeBERT tokenizer and model for EMBEDDING_BACKEND, once."""
+    global model, onnx_embedder, embedding_dimension, embedding_cache_model
+    if embedding_dimension is not None:
+        return
+    load_tokenizer()
+    with embedding_model_lock:
+        if embedding_dimension is not None:
+            return
+        model_status["embedding"] = "loading"
+        start_time = time.time()
+        try:
+            if EMBEDDING_BACKEND == "onnx":
+                from codebert_onnx import OnnxEmbedder
+
+                # Exporting the ONNX model loads the PyTorch one first
+                with from_pretrained_lock:
+                    onnx_embedder = OnnxEmbedder(
+                        CODEBERT_MODEL_NAME,
+                        num_threads=TORCH_NUM_THREADS,
+                        tokenizer=tokenizer,
+                    )
+                # ONNX vectors are cached apart from the PyTorch ones
+                embedding_cache_model = onnx_embedder.cache_model_name
+                # Set last: a dimension marks the embedding model as loaded
+                embedding_dimension = onnx_embedder.dimension
+            else:
+                with from_pretrained_lock:
+                    model = AutoModel.from_pretrained(
+                        CODEBERT_MODEL_NAME, low_cpu_mem_usage=True
+                    )
+                model.to("cpu")  # Use 'cuda' if available
+                model.eval()
+                embedding_cache_model = CODEBERT_MODEL_NAME
+                embedding_dimension = model.config.hidden_size
+        except Exception as e:
+            model_status["embedding"] = f"failed: {e}"
+            raise
+        model_status["embedding"] = "ready"
+        print(
+            f"Loaded {CODEBERT_MODEL_NAME} ({EMBEDDING_BACKEND}) "
+            f"in {time.time() - start_time:.1f} seconds"
+        )
+
+
+def load_chat_model():
+    """Load the GPT-J tokenizer and model in CHAT_MODEL_DTYPE, once."""
+    global chat_tokenizer, chat_model
+    if chat_model is not None:
+        return
+    with chat_model_lock:
+        if chat_model is not None:
+            return
+        model_status["chat"] = "loading"
+        start_time = time.time()
+        try:
+            loaded_tokenizer = AutoTokenizer.from_pretrained(CHAT_MODEL_NAME)
+            # low_cpu_mem_usage loads weights one at a time instead of building
+            # a randomly initialized copy of the model first
+            with from_pretrained_lock:
+                loaded_model = AutoModelForCausalLM.from_pretrained(
+                    CHAT_MODEL_NAME,
+                    torch_dtype=(
+                        torch.bfloat16
+                        if CHAT_MODEL_DTYPE == "bfloat16"
+                        else torch.float32
+                    ),
+                    low_cpu_mem_usage=True,
+                )
+            loaded_model.to("cpu")  # Use 'cuda' if available
+            loaded_model.eval()
+            if CHAT_MODEL_DTYPE == "int8":
+                loaded_model = torch.quantization.quantize_dynamic(
+                    loaded_model, {torch.nn.Linear}, dtype=torch.qint8
+                )
+        except Exception as e:
+            model_status["chat"] = f"failed: {e}"
+            raise
+        chat_tokenizer = loaded_tokenizer
+        chat_model = loaded_model
+        model_status["chat"] = "ready"
+        print(
+            f"Loaded {CHAT_MODEL_NAME} ({CHAT_MODEL_DTYPE}) "
+            f"in {time.time() - start_time:.1f} seconds"
+        )
 
-# Initialize GPT-J model and tokenizer
-chat_model_name = "EleutherAI/gpt-j-6B"
-chat_tokenizer = AutoTokenizer.from_pretrained(chat_model_name)
-chat_model = AutoModelForCausalLM.from_pretrained(chat_model_name)
-chat_model.to("cpu")  # Use 'cuda' if available
 
 repo_path = "/repo"
 
-current_repo_url = None  # To store the current repository URL
-faiss_index = None
-code_chunks = None
+CLONE_DIR_BASE = "repos"  # Each repository is cloned into its own directory
+MAX_CACHED_REPOS = 8  # Indexed repositories kept in memory, least recent dropped
+REMOTE_CHECK_SECONDS = 60  # Minimum interval between checks for new commits
 
 
-@timing_decorator
-def initialize_codebase(repo_url):
-    global faiss_index, code_chunks, current_repo_url
+class RepoIndex:
+    """FAISS index and chunks of a repository at one commit."""
 
-    if current_repo_url == repo_url:
-        print(f"Repository {repo_url} is already initialized.")
-        return
-    else:
-        print("Codebase has not yet been initialized... Cloning now")
+    def __init__(self, faiss_index, code_chunks, repo_path, commit):
+        self.faiss_index = faiss_index
+        self.code_chunks = code_chunks
+        self.repo_path = repo_path
+        self.commit = commit
+        # File paths of code_chunks, for @file and @dir questions
+        self.path_index = PathIndex.from_chunks(code_chunks, repo_path)
+        self.checked_at = time.time()  # Last time the remote HEAD was compared
+
+
+repo_indexes = OrderedDict()  # repo_url -> RepoIndex, least recently used first
+repo_indexes_lock = Lock()
+repo_locks = {}  # repo_url -> Lock held while the repository is indexed
+
+
+def get_clone_dir(repo_url):
+    repo_hash = hashlib.sha256(repo_url.encode()).hexdigest()[:10]
+    return os.path.join(CLONE_DIR_BASE, repo_hash)
 
+
+def get_remote_head(repo_url):
+    """Commit the remote HEAD of repo_url points to, without fetching anything."""
+    output = git.cmd.Git().ls_remote(repo_url, "HEAD")
+    return output.split()[0] if output else None
+
+
+@timing_decorator
+def build_repo_index(repo_url):
+    """Clone repo_url and index it, and put its RepoIndex in the cache."""
     # Clone the repository
-    repo_path = clone_github_repo(repo_url)
+    repo_path = clone_github_repo(repo_url, get_clone_dir(repo_url))
 
     # Parse the codebase and create chunks
     code_chunks = read_files(repo_path)
 
-    # Generate embeddings for the chunks
-    embeddings = get_embeddings(code_chunks)
+    # Generate embeddings for the chunks; unchanged chunks come from the cache
+    embeddings = load_embeddings(code_chunks)
 
     # Store embeddings in a FAISS vector store
     faiss_index = store_in_faiss(embeddings)
 
-    current_repo_url = repo_url  # Update the current repository URL
+    repo_index = RepoIndex(
+        faiss_index, code_chunks, repo_path, get_latest_commit_hash(repo_path)
+    )
+    with repo_indexes_lock:
+        repo_indexes[repo_url] = repo_index
+        repo_indexes.move_to_end(repo_url)
+        while len(repo_indexes) > MAX_CACHED_REPOS:
+            evicted_url, _ = repo_indexes.popitem(last=False)
+            # A lock still held is re-indexing the repository, which re-adds it
+            evicted_lock = repo_locks.get(evicted_url)
+            if evicted_lock is not None and not evicted_lock.locked():
+                del repo_locks[evicted_url]
+            print(f"Evicted {evicted_url} from the repository cache")
+    return repo_index
+
+
+@timing_decorator
+def initialize_codebase(repo_url):
+    """
+    Return the RepoIndex of repo_url, indexing the repository the first time and
+    again whenever its remote HEAD has moved. The remote is checked at most once
+    every REMOTE_CHECK_SECONDS, so most calls return straight from the cache.
+
+    A re-index runs in the one request that saw the remote move; requests made
+    meanwhile are answered from the previous index instead of waiting for it.
+    """
+    with repo_indexes_lock:
+        repo_index = repo_indexes.get(repo_url)
+        if repo_index is not None:
+            repo_indexes.move_to_end(repo_url)
+            if time.time() - repo_index.checked_at < REMOTE_CHECK_SECONDS:
+                return repo_index
+            # Claim the check, so concurrent requests keep using the index
+            repo_index.checked_at = time.time()
+        lock = repo_locks.setdefault(repo_url, Lock())
+
+    if repo_index is not None:
+        try:
+            remote_head = get_remote_head(repo_url)
+        except git.exc.GitCommandError as e:
+            print(f"Could not check {repo_url} for new commits: {e}")
+            remote_head = repo_index.commit
+        if remote_head == repo_index.commit:
+            print(f"Repository {repo_url} is already initialized.")
+            return repo_index
+        if not lock.acquire(blocking=False):
+            # Another request is indexing the repository already
+            return repo_index
+        try:
+            print(f"Repository {repo_url} moved to {remote_head}... Re-indexing now")
+            return build_repo_index(repo_url)
+        finally:
+            lock.release()
+
+    with lock:
+        # The repository may have been indexed while waiting for the lock
+        with repo_indexes_lock:
+            repo_index = repo_indexes.get(repo_url)
+        if repo_index is not None:
+            return repo_index
+        print("Codebase has not yet been initialized... Cloning now")
+        return build_repo_index(repo_url)
+
+
+def embed_texts(texts, batch_size=EMBEDDING_BATCH_SIZE):
+    """
+    Embed texts with CodeBERT in padded batches.
+
+    Texts are tokenized once and sorted by length, so each batch holds inputs of
+    similar length and is only padded to its own longest input. Token vectors are
+    mean-pooled over the attention mask, so padding doesn't change a text's
+    embedding.
+
+    Args:
+        texts (list): Texts to embed.
+        batch_size (int): Inputs per forward pass.
+
+    Returns:
+        np.ndarray: float32 matrix of shape (len(texts), hidden_size), in input order.
+    """
+    load_embedding_model()
+    if onnx_embedder is not None:
+        return onnx_embedder.embed_texts(texts, batch_size)
+
+    embeddings = np.empty((len(texts), embedding_dimension), dtype=np.float32)
+    if not len(texts):
+        return embeddings
+    input_ids = tokenizer(list(texts), truncation=True, max_length=CODEBERT_MAX_LENGTH)[
+        "input_ids"
+    ]
+    order = sorted(range(len(texts)), key=lambda i: len(input_ids[i]))
+
+    with torch.inference_mode():
+        for start in range(0, len(order), batch_size):
+            batch = order[start : start + batch_size]
+            inputs = tokenizer.pad(
+                {"input_ids": [input_ids[i] for i in batch]}, return_tensors="pt"
+            )
+            outputs = model(**inputs)
+            mask = (
+                inputs["attention_mask"]
+                .unsqueeze(-1)
+                .to(outputs.last_hidden_state.dtype)
+            )
+            summed = (outputs.last_hidden_state * mask).sum(dim=1)
+            pooled = summed / mask.sum(dim=1).clamp(min=1)
+            embeddings[batch] = pooled.float().numpy()
+    return embeddings
 
 
 def get_embedding(text):
-    inputs = tokenizer(text, return_tensors="pt", truncation=True, max_length=512)
-    with torch.no_grad():
-        outputs = model(**inputs)
-    # Mean pooling
-    embeddings = outputs.last_hidden_state.mean(dim=1).squeeze()
-    return embeddings.numpy()
+    return embed_texts([text])[0]
 
 
 def get_embeddings(chunks):
-    embeddings = []
-    for file_path, chunk in chunks:
-        embedding = get_embedding(chunk)
-        embeddings.append(embedding)
-    return embeddings
+    return list(embed_texts([chunk for file_path, chunk in chunks]))
 
 
-@timing_decorator
-def query_vector_store(
-    index: faiss.IndexFlatIP,
-    chunks: list,
-    question: str,
-    k: int = 10,
-    max_length: int = 512,
-) -> str:
+def build_prompt(index, chunks, question, k=10, ids=None):
     """
-    Query the FAISS index with the question, retrieve top k relevant code chunks,
-    and generate a response using GPT-J.
+    Retrieve the top k code chunks for the question from the FAISS index and
+    build the GPT-J prompt around them.
 
     Args:
         index (faiss.IndexFlatIP): FAISS index containing code embeddings.
         chunks (list): List of tuples containing (file_path, code_chunk).
         question (str): The user's question.
         k (int): Number of top similar chunks to retrieve.
-        max_length (int): Maximum length of the generated response.
+        ids (np.ndarray, optional): Restrict retrieval to these chunk ids.
 
     Returns:
-        str: The generated response.
+        str: The prompt.
     """
     # Step 1: Embed the question using CodeBERT
     print("Generating embedding for the question...")
@@ -137,8 +396,11 @@ def query_vector_store(
 
     # Step 2: Query the FAISS index for top k similar code chunks
     print(f"Searching for the top {k} similar code chunks...")
-    distances, indices = index.search(question_embedding, k)
-    relevant_chunks = [chunks[i] for i in indices[0]]
+    if ids is None:
+        distances, indices = index.search(question_embedding, k)
+    else:
+        distances, indices = search_ids(index, question_embedding, k, ids)
+    relevant_chunks = [chunks[i] for i in indices[0] if 0 <= i < len(chunks)]
 
     # Step 3: Concatenate the retrieved code chunks to form context
     print("Concatenating relevant code chunks into context...")
@@ -147,7 +409,7 @@ def query_vector_store(
     )
 
     # Step 4: Create a prompt for GPT-J
-    prompt = (
+    return (
         "You are a technical documentation expert. Given the following code snippets, "
         "answer the question in markdown format.\n\n"
         f"Code Snippets:\n{context}\n\n"
@@ -155,31 +417,125 @@ def query_vector_store(
         "Answer:"
     )
 
-    # Step 5: Tokenize and generate response using GPT-J
-    print("Generating response using GPT-J...")
+
+class StopOnEvent(StoppingCriteria):
+    """Ends generation early once the event is set, e.g. when a client leaves."""
+
+    def __init__(self, event):
+        self.event = event
+
+    def __call__(self, input_ids, scores, **kwargs):
+        return self.event.is_set()
+
+
+def generate_stream(prompt, max_length=512):
+    """
+    Generate the answer to prompt with GPT-J, yielding text as it is decoded.
+
+    GPT-J is loaded and the prompt encoded before this returns, so a caller in
+    the threadpool does all blocking setup there and load errors surface before
+    any response is sent. Generation then runs in a worker thread that feeds a
+    TextIteratorStreamer, so the first words arrive after about one forward
+    pass instead of after the whole sequence. Closing the generator stops the
+    worker at its next token.
+
+    Args:
+        prompt (str): The prompt, which is not repeated in the output.
+        max_length (int): Maximum length of prompt plus answer, in tokens.
+
+    Returns:
+        Iterator[str]: Pieces of the answer.
+    """
+    load_chat_model()
     inputs = chat_tokenizer.encode(prompt, return_tensors="pt")
     inputs = inputs.to(chat_model.device)
 
-    with torch.no_grad():
-        outputs = chat_model.generate(
-            inputs,
-            max_length=max_length,
-            num_return_sequences=1,
-            no_repeat_ngram_size=2,
-            early_stopping=True,
-            temperature=0.7,
-            top_p=0.9,
-            do_sample=True,
+    def stream_answer():
+        streamer = TextIteratorStreamer(
+            chat_tokenizer, skip_prompt=True, skip_special_tokens=True
         )
+        stop = Event()
+        errors = []
 
-    response = chat_tokenizer.decode(outputs[0], skip_special_tokens=True)
+        def generate():
+            try:
+                with torch.no_grad():
+                    chat_model.generate(
+                        inputs,
+                        max_length=max_length,
+                        num_return_sequences=1,
+                        no_repeat_ngram_size=2,
+                        early_stopping=True,
+                        temperature=0.7,
+                        top_p=0.9,
+                        do_sample=True,
+                        streamer=streamer,
+                        stopping_criteria=StoppingCriteriaList([StopOnEvent(stop)]),
+                    )
+            except Exception as e:
+                errors.append(e)
+                streamer.end()  # Unblock the consumer
 
-    # Optional: Extract only the answer part if the model tends to repeat the prompt
-    if "Answer:" in response:
-        answer = response.split("Answer:")[-1].strip()
-    else:
-        answer = response.strip()
+        worker = Thread(target=generate, daemon=True)
+        worker.start()
+        try:
+            yield from (piece for piece in streamer if piece)
+        finally:
+            stop.set()
+        worker.join()
+        if errors:
+            raise errors[0]
+
+    return stream_answer()
+
+
+def stream_vector_store(
+    index: faiss.IndexFlatIP,
+    chunks: list,
+    question: str,
+    k: int = 10,
+    max_length: int = 512,
+    ids: np.ndarray = None,
+):
+    """
+    Streaming version of query_vector_store. Retrieval, prompt building and
+    model loading all run before this returns; only generation is deferred to
+    the returned iterator, which yields the answer piece by piece.
+    """
+    prompt = build_prompt(index, chunks, question, k, ids)
+    print("Streaming response from GPT-J...")
+    return generate_stream(prompt, max_length)
+
+
+@timing_decorator
+def query_vector_store(
+    index: faiss.IndexFlatIP,
+    chunks: list,
+    question: str,
+    k: int = 10,
+    max_length: int = 512,
+    ids: np.ndarray = None,
+) -> str:
+    """
+    Query the FAISS index with the question, retrieve top k relevant code chunks,
+    and generate a response using GPT-J.
 
+    Args:
+        index (faiss.IndexFlatIP): FAISS index containing code embeddings.
+        chunks (list): List of tuples containing (file_path, code_chunk).
+        question (str): The user's question.
+        k (int): Number of top similar chunks to retrieve.
+        max_length (int): Maximum length of the generated response.
+        ids (np.ndarray, optional): Restrict retrieval to these chunk ids.
+
+    Returns:
+        str: The generated response.
+    """
+    # Only the generated text is streamed, so the prompt needs no stripping
+    print("Generating response using GPT-J...")
+    answer = "".join(
+        stream_vector_store(index, chunks, question, k, max_length, ids)
+    ).strip()
     print("Response generated.")
     return answer
 
@@ -209,26 +565,18 @@ def update_stored_hash(repo_path, hash_file="commit_hash.txt"):
         f.write(current_hash)
 
 
-@timing_decorator
-def load_embedding_cache(db_file="embedding_cache.db"):
-    conn = sqlite3.connect(db_file)
-    cursor = conn.cursor()
-    # Create table if it doesn't exist
-    cursor.execute(
-        """
-        CREATE TABLE IF NOT EXISTS embeddings (
-            hash TEXT PRIMARY KEY,
-            embedding BLOB
-        )
-    """
-    )
-    return conn, cursor
+# Bump whenever read_files starts producing different chunk texts
+CHUNKER_VERSION = "v1"
+CACHE_COMMIT_BATCHES = 8  # Embedding batches stored per cache commit
 
 
 @timing_decorator
 @retry(wait=wait_random_exponential(min=1, max=60), stop=stop_after_attempt(6))
 def get_embeddings_from_cache(chunks, db_file="embedding_cache.db"):
+    load_embedding_model()
     conn, cursor = load_embedding_cache(db_file)
+    # The cache is shared with the OpenAI servers, so vectors are namespaced by model
+    dimension = embedding_dimension
     embeddings = [None] * len(chunks)
     chunk_hashes = []
     chunk_texts = []
@@ -243,18 +591,11 @@ def get_embeddings_from_cache(chunks, db_file="embedding_cache.db"):
         indices.append(idx)
 
     # Fetch all existing embeddings in batches
-    hash_to_embedding = {}
-    batch_size = 900  # SQLite limit is 999
-    for i in range(0, len(chunk_hashes), batch_size):
-        batch_hashes = chunk_hashes[i : i + batch_size]
-        placeholders = ",".join(["?"] * len(batch_hashes))
-        cursor.execute(
-            f"SELECT hash, embedding FROM embeddings WHERE hash IN ({placeholders})",
-            batch_hashes,
+    hash_to_embedding = dict(
+        lookup_embeddings(
+            cursor, embedding_cache_model, dimension, CHUNKER_VERSION, chunk_hashes
         )
-        rows = cursor.fetchall()
-        for row in rows:
-            hash_to_embedding[row[0]] = np.frombuffer(row[1], dtype=np.float32)
+    )
 
     texts_to_embed = []
     indices_to_embed = []
@@ -268,21 +609,24 @@ def get_embeddings_from_cache(chunks, db_file="embedding_cache.db"):
             indices_to_embed.append(idx)
             hashes_to_embed.append(chunk_hash)
 
-    # Now batch embed the texts_to_embed
-    if texts_to_embed:
-        for text, hash_val, idx in zip(
-            texts_to_embed, hashes_to_embed, indices_to_embed
-        ):
-            try:
-                embedding = get_embedding(text)
-                embeddings[idx] = embedding
-                cursor.execute(
-                    "INSERT INTO embeddings (hash, embedding) VALUES (?, ?)",
-                    (hash_val, embedding.tobytes()),
-                )
-            except Exception as e:
-                print("Error during embedding generation:", e)
-                continue
+    # Now batch embed the texts_to_embed, committing each group as it finishes
+    group_size = EMBEDDING_BATCH_SIZE * CACHE_COMMIT_BATCHES
+    for start in range(0, len(texts_to_embed), group_size):
+        group = slice(start, start + group_size)
+        try:
+            group_embeddings = embed_texts(texts_to_embed[group])
+        except Exception as e:
+            print("Error during embedding generation:", e)
+            continue
+        for idx, embedding in zip(indices_to_embed[group], group_embeddings):
+            embeddings[idx] = embedding
+        store_embeddings(
+            cursor,
+            embedding_cache_model,
+            dimension,
+            CHUNKER_VERSION,
+            list(zip(hashes_to_embed[group], group_embeddings)),
+        )
         conn.commit()
 
     conn.close()
@@ -296,6 +640,17 @@ def load_embeddings(chunks):
 
 @timing_decorator
 def find_file(repo_path, filepath):
+    with repo_indexes_lock:
+        indexed = [
+            repo_index
+            for repo_index in repo_indexes.values()
+            if os.path.abspath(repo_index.repo_path) == os.path.abspath(repo_path)
+        ]
+    if indexed:
+        # Resolved from the paths indexed at initialization, without walking
+        matches = indexed[0].path_index.find_files(filepath, fuzzy=False)
+        return "found %s" % os.path.join(repo_path, matches[0]) if matches else None
+
     for path, directories, files in os.walk(repo_path):
         print(directories)
         if filepath in files:
@@ -333,6 +688,7 @@ MAX_TOKENS = 8191  # Adjust if necessary
 
 def read_files(repo_path):
     print("Reading and processing files...")
+    load_tokenizer()
     code_chunks = []
     file_paths = []
 
@@ -399,89 +755,180 @@ def store_in_faiss(embeddings):
 
 
 @timing_decorator
-def code_assistant_pipeline(repo_url: str, question: str, file: str = None) -> str:
+def code_assistant_pipeline(
+    repo_url: str,
+    question: str,
+    file: str = None,
+    directory: str = None,
+    stream: bool = False,
+):
     """
-    Pipeline to process the repository, embed code chunks, store in FAISS, and generate an answer.
+    Answer a question from the cached index of the repository, cloning and
+    indexing it first if it is new or has new commits.
 
     Args:
         repo_url (str): The URL of the repository to analyze.
         question (str): The user's question.
         file (str, optional): Specific file to analyze. Defaults to None.
+        directory (str, optional): Specific directory to analyze. Defaults to None.
+        stream (bool): Return a generator of answer pieces instead of a string.
 
     Returns:
-        str: The generated answer.
+        str | Iterator[str]: The generated answer.
     """
-    # Clone repo
-    repo_path = clone_github_repo(repo_url)
-
-    # Read and chunk the code
-    if file:
-        code_chunks = read_files(file)
-    else:
-        code_chunks = read_files(repo_path)
-
-    # Embed the code chunks
-    embeddings = load_embeddings(code_chunks)
-
-    # Store embeddings in FAISS vector store
-    index = store_in_faiss(embeddings)
+    # Reuse the index of the repository at its current commit
+    repo_index = initialize_codebase(repo_url)
+
+    ids = None
+    scope_note = ""
+    if file or directory:
+        # Scoped questions search the chunks of the matching files only
+        if file:
+            paths = repo_index.path_index.find_files(file)
+        else:
+            paths = repo_index.path_index.find_directory(directory)
+        if not paths:
+            raise ValueError(f"No indexed file matches '{file or directory}'.")
+        ids = repo_index.path_index.chunk_ids(paths)
+        scope_note = describe_scope(paths)
 
     # Query the vector store with a question
-    answer = query_vector_store(
-        index=index, chunks=code_chunks, question=question, k=10, max_length=512
+    answer = (stream_vector_store if stream else query_vector_store)(
+        index=repo_index.faiss_index,
+        chunks=repo_index.code_chunks,
+        question=question,
+        k=10,
+        max_length=512,
+        ids=ids,
     )
 
-    return answer
+    # Name the files a scoped answer comes from, as the path may have been guessed
+    if stream:
+        return itertools.chain([scope_note], answer)
+    return scope_note + answer
 
 
 @timing_decorator
-async def AIQuery(question: str, repo_url: str) -> str:
+async def AIQuery(question: str, repo_url: str, stream: bool = False):
     """
-    Asynchronous function to handle AI queries.
+    Asynchronous function to handle AI queries. The pipeline runs in the
+    threadpool, so cloning, indexing and model loading never block the event loop.
 
     Args:
         question (str): The user's question.
         repo_url (str): The URL of the repository to analyze.
+        stream (bool): Return a generator of answer pieces instead of a string.
 
     Returns:
-        str: The generated answer.
+        str | Iterator[str]: The generated answer.
     """
-    if question.startswith("@file"):
-        parts = question.split(" ", 2)
-        if len(parts) < 3:
-            raise ValueError(
-                "Invalid @file command format. Expected '@file <filepath> <question>'."
-            )
-        filepath = parts[1]
-        sub_question = parts[2]
-        answer = code_assistant_pipeline(
-            repo_url=repo_url, question=sub_question, file=filepath
+    scope, path, sub_question = parse_scoped_question(question)
+    if scope == "file":
+        answer = await run_in_threadpool(
+            code_assistant_pipeline,
+            repo_url=repo_url,
+            question=sub_question,
+            file=path,
+            stream=stream,
+        )
+        return answer
+    elif scope == "dir":
+        answer = await run_in_threadpool(
+            code_assistant_pipeline,
+            repo_url=repo_url,
+            question=sub_question,
+            directory=path,
+            stream=stream,
         )
         return answer
     else:
-        answer = code_assistant_pipeline(repo_url=repo_url, question=question)
+        answer = await run_in_threadpool(
+            code_assistant_pipeline, repo_url=repo_url, question=question, stream=stream
+        )
         return answer
 
 
+# Background model and repository warm-up started at startup
+warmup_executor = concurrent.futures.ThreadPoolExecutor(
+    max_workers=2, thread_name_prefix="warmup"
+)
+
+
+def warm_up_embeddings():
+    """Load CodeBERT and run one batch through it."""
+    load_embedding_model()
+    embed_texts(["def warm_up():\n    return None"])
+
+
+def warm_up_chat():
+    """Load GPT-J and generate one token, so the first question isn't slowed."""
+    load_chat_model()
+    inputs = chat_tokenizer.encode("def warm_up():", return_tensors="pt")
+    with torch.no_grad():
+        chat_model.generate(inputs.to(chat_model.device), max_new_tokens=1)
+
+
+def log_warmup_error(future):
+    if future.exception() is not None:
+        print(f"Warm-up failed: {future.exception()}")
+
+
+def warm_up():
+    # CodeBERT goes first: it is small, and questions and indexing both need it.
+    # GPT-J and the repository are then warmed up side by side
+    warm_up_embeddings()
+    futures = [warmup_executor.submit(warm_up_chat)]
+    if WARMUP_REPO_URL:
+        futures.append(warmup_executor.submit(initialize_codebase, WARMUP_REPO_URL))
+    for future in futures:
+        future.add_done_callback(log_warmup_error)
+
+
 @app.on_event("startup")
 def on_startup():
-    # Initialize the codebase when the API starts
-    default_repo = "https://github.com/kavjeydev/bitwise-longest-repeating.git"
-    initialize_codebase(default_repo)
+    # Returns at once so health checks pass while models load in the background
+    if not MODEL_WARMUP:
+        return
+    warmup_executor.submit(warm_up).add_done_callback(log_warmup_error)
+
+
+@app.get("/health")
+async def health():
+    # Liveness only: the process is up and serving requests
+    return {"status": "ok"}
+
+
+@app.get("/ready")
+async def ready():
+    # Ready once both models are loaded; questions before that load them inline
+    is_ready = all(status == "ready" for status in model_status.values())
+    return JSONResponse(
+        {"ready": is_ready, "models": model_status},
+        status_code=200 if is_ready else 503,
+    )
 
 
 @app.post("/apirun")
 async def respond(queryItem: QueryItem):
     try:
         start_t = time.time()
-        response = await AIQuery(
+        # Retrieval runs in the threadpool before the response starts; only
+        # generation happens while the answer streams
+        answer_stream = await AIQuery(
             question=queryItem.query,
             repo_url=queryItem.repoUrl
             or "https://github.com/kavjeydev/bitwise-longest-repeating.git",
+            stream=True,
         )
         end_t = time.time()
-        print("TOTAL TIME:", end_t - start_t)
-        queryItem.response = response
-        return queryItem
+        print("TIME TO STREAM:", end_t - start_t)
+        return StreamingResponse(
+            answer_stream,
+            media_type="text/plain",
+            headers={
+                "Cache-Control": "no-cache",
+                "Transfer-Encoding": "chunked",
+            },
+        )
     except Exception as e:
-        return {"error": str(e)}
+        return JSONResponse({"error": str(e)}, status_code=500)
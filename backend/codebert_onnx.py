@@ -0,0 +1,288 @@
+"""
+ONNX Runtime backend for CodeBERT embeddings, used by code_bert.py when
+EMBEDDING_BACKEND is "onnx".
+
+The model is exported to ONNX once, dynamically quantized to int8 and cached
+under ONNX_MODEL_DIR. Embeddings are pooled exactly like the PyTorch path, but
+int8 vectors differ slightly from fp32 ones, so they are cached under their own
+model name. Run `python codebert_onnx.py --help` to export the model, compare it
+against PyTorch (parity) or measure throughput (bench).
+
+Requires onnxruntime; exporting also needs torch, transformers and onnx.
+"""
+
+import argparse
+import os
+import time
+
+import numpy as np
+
+CODEBERT_MODEL_NAME = "microsoft/codebert-base"
+CODEBERT_MAX_LENGTH = 512  # Tokens per input, including special tokens
+EMBEDDING_BATCH_SIZE = 32  # Inputs per forward pass
+ONNX_MODEL_DIR = "build/codebert-onnx"
+ONNX_OPSET = 14
+PARITY_MIN_COSINE = 0.99  # Lowest acceptable cosine similarity to PyTorch
+
+
+def onnx_model_paths(model_name=CODEBERT_MODEL_NAME, model_dir=ONNX_MODEL_DIR):
+    """Paths of the fp32 and int8 ONNX files of model_name."""
+    base = os.path.join(model_dir, model_name.strip("/").replace("/", "_"))
+    return f"{base}.onnx", f"{base}.int8.onnx"
+
+
+def export_onnx(model_name, path):
+    """Export the encoder of model_name to ONNX with dynamic batch and length."""
+    import torch
+    from transformers import AutoModel, AutoTokenizer
+
+    class LastHiddenState(torch.nn.Module):
+        def __init__(self, model):
+            super().__init__()
+            self.model = model
+
+        def forward(self, input_ids, attention_mask):
+            outputs = self.model(input_ids=input_ids, attention_mask=attention_mask)
+            return outputs.last_hidden_state
+
+    model = AutoModel.from_pretrained(model_name)
+    model.eval()
+    tokenizer = AutoTokenizer.from_pretrained(model_name)
+    sample = tokenizer(["def f(x):", "return x"], padding=True, return_tensors="pt")
+    dynamic_axes = {0: "batch", 1: "sequence"}
+
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    tmp_path = f"{path}.tmp"
+    with torch.inference_mode():
+        torch.onnx.export(
+            LastHiddenState(model),
+            (sample["input_ids"], sample["attention_mask"]),
+            tmp_path,
+            input_names=["input_ids", "attention_mask"],
+            output_names=["last_hidden_state"],
+            dynamic_axes={
+                "input_ids": dynamic_axes,
+                "attention_mask": dynamic_axes,
+                "last_hidden_state": dynamic_axes,
+            },
+            opset_version=ONNX_OPSET,
+            dynamo=False,
+        )
+    os.replace(tmp_path, path)
+    return path
+
+
+def quantize_onnx(fp32_path, int8_path):
+    """Quantize the weights of an exported model to int8 (activations stay fp32)."""
+    from onnxruntime.quantization import QuantType, quantize_dynamic
+
+    tmp_path = f"{int8_path}.tmp"
+    quantize_dynamic(fp32_path, tmp_path, weight_type=QuantType.QInt8)
+    os.replace(tmp_path, int8_path)
+    return int8_path
+
+
+def ensure_onnx_model(
+    model_name=CODEBERT_MODEL_NAME, model_dir=ONNX_MODEL_DIR, quantized=True
+):
+    """Export (and quantize) the model unless it already is; return its path."""
+    fp32_path, int8_path = onnx_model_paths(model_name, model_dir)
+    if not os.path.exists(fp32_path):
+        print(f"Exporting {model_name} to {fp32_path}")
+        export_onnx(model_name, fp32_path)
+    if quantized and not os.path.exists(int8_path):
+        print(f"Quantizing {fp32_path} to {int8_path}")
+        quantize_onnx(fp32_path, int8_path)
+    return int8_path if quantized else fp32_path
+
+
+def masked_mean(hidden_states, attention_mask):
+    """Mean of the token vectors of each input, ignoring padding."""
+    mask = attention_mask[:, :, None].astype(hidden_states.dtype)
+    return (hidden_states * mask).sum(axis=1) / np.maximum(mask.sum(axis=1), 1)
+
+
+class OnnxEmbedder:
+    """
+    CodeBERT embeddings computed with ONNX Runtime on CPU.
+
+    Args:
+        model_name (str): Hugging Face model name or local path.
+        model_dir (str): Directory of the exported ONNX files.
+        quantized (bool): Use the int8 model instead of the fp32 one.
+        num_threads (int, optional): ONNX Runtime intra-op threads.
+        tokenizer (optional): Tokenizer of model_name, loaded if not given.
+    """
+
+    def __init__(
+        self,
+        model_name=CODEBERT_MODEL_NAME,
+        model_dir=ONNX_MODEL_DIR,
+        quantized=True,
+        num_threads=None,
+        tokenizer=None,
+    ):
+        import onnxruntime as ort
+
+        if tokenizer is None:
+            from transformers import AutoTokenizer
+
+            tokenizer = AutoTokenizer.from_pretrained(model_name)
+        self.tokenizer = tokenizer
+        self.model_path = ensure_onnx_model(model_name, model_dir, quantized)
+
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        if num_threads:
+            options.intra_op_num_threads = num_threads
+        self.session = ort.InferenceSession(
+            self.model_path, options, providers=["CPUExecutionProvider"]
+        )
+        self.dimension = self.session.get_outputs()[0].shape[-1]
+        # Part of the embedding cache key, so these vectors never mix with fp32 ones
+        self.cache_model_name = f"{model_name}+onnx{'-int8' if quantized else ''}"
+
+    def embed_texts(self, texts, batch_size=EMBEDDING_BATCH_SIZE):
+        """
+        Embed texts in length-sorted, padded batches.
+
+        Returns:
+            np.ndarray: float32 matrix of shape (len(texts), dimension), in input order.
+        """
+        embeddings = np.empty((len(texts), self.dimension), dtype=np.float32)
+        if not len(texts):
+            return embeddings
+        input_ids = self.tokenizer(
+            list(texts), truncation=True, max_length=CODEBERT_MAX_LENGTH
+        )["input_ids"]
+        order = sorted(range(len(texts)), key=lambda i: len(input_ids[i]))
+
+        for start in range(0, len(order), batch_size):
+            batch = order[start : start + batch_size]
+            inputs = self.tokenizer.pad(
+                {"input_ids": [input_ids[i] for i in batch]}, return_tensors="np"
+            )
+            attention_mask = inputs["attention_mask"].astype(np.int64)
+            (hidden_states,) = self.session.run(
+                ["last_hidden_state"],
+                {
+                    "input_ids": inputs["input_ids"].astype(np.int64),
+                    "attention_mask": attention_mask,
+                },
+            )
+            embeddings[batch] = masked_mean(hidden_states, attention_mask)
+        return embeddings
+
+
+def embed_texts_torch(model, tokenizer, texts, batch_size=EMBEDDING_BATCH_SIZE):
+    """Reference PyTorch embeddings, pooled the same way as code_bert.embed_texts."""
+    import torch
+
+    embeddings = []
+    with torch.inference_mode():
+        for start in range(0, len(texts), batch_size):
+            inputs = tokenizer(
+                texts[start : start + batch_size],
+                truncation=True,
+                max_length=CODEBERT_MAX_LENGTH,
+                padding=True,
+                return_tensors="pt",
+            )
+            outputs = model(**inputs)
+            embeddings.append(
+                masked_mean(
+                    outputs.last_hidden_state.float().numpy(),
+                    inputs["attention_mask"].numpy(),
+                )
+            )
+    return np.concatenate(embeddings).astype(np.float32)
+
+
+def load_sample_texts(directory, limit, chars=2000):
+    """Up to limit code snippets read from the source files under directory."""
+    texts = []
+    for root, dirs, files in os.walk(directory):
+        dirs[:] = [d for d in dirs if not d.startswith(".") and d != "node_modules"]
+        for file in sorted(files):
+            if not file.endswith((".py", ".js", ".ts", ".tsx", ".jsx", ".cpp")):
+                continue
+            with open(os.path.join(root, file), "r", encoding="utf-8") as f:
+                content = f.read()
+            texts.extend(
+                content[i : i + chars]
+                for i in range(0, len(content), chars)
+                if content[i : i + chars].strip()
+            )
+            if len(texts) >= limit:
+                return texts[:limit]
+    return texts
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Export, verify and benchmark the ONNX CodeBERT backend"
+    )
+    parser.add_argument("command", choices=("export", "parity", "bench"))
+    parser.add_argument("--model", default=CODEBERT_MODEL_NAME)
+    parser.add_argument("--model-dir", default=ONNX_MODEL_DIR)
+    parser.add_argument("--fp32", action="store_true", help="Skip int8 quantization")
+    parser.add_argument("--texts", default=".", help="Directory to sample code from")
+    parser.add_argument("--limit", type=int, default=256)
+    parser.add_argument("--batch-size", type=int, default=EMBEDDING_BATCH_SIZE)
+    parser.add_argument("--threads", type=int, default=os.cpu_count())
+    args = parser.parse_args()
+
+    quantized = not args.fp32
+    if args.command == "export":
+        print(ensure_onnx_model(args.model, args.model_dir, quantized))
+        return
+
+    import torch
+    from transformers import AutoModel, AutoTokenizer
+
+    torch.set_num_threads(args.threads)
+    tokenizer = AutoTokenizer.from_pretrained(args.model)
+    embedder = OnnxEmbedder(
+        args.model, args.model_dir, quantized, args.threads, tokenizer
+    )
+    model = AutoModel.from_pretrained(args.model)
+    model.eval()
+    texts = load_sample_texts(args.texts, args.limit)
+    if not texts:
+        parser.error(f"No source files found under {args.texts}")
+
+    # Warm up both backends before timing them
+    embed_texts_torch(model, tokenizer, texts[:2])
+    embedder.embed_texts(texts[:2])
+
+    start_time = time.perf_counter()
+    reference = embed_texts_torch(model, tokenizer, texts, args.batch_size)
+    torch_seconds = time.perf_counter() - start_time
+    start_time = time.perf_counter()
+    embeddings = embedder.embed_texts(texts, args.batch_size)
+    onnx_seconds = time.perf_counter() - start_time
+
+    if args.command == "parity":
+        cosines = (embeddings * reference).sum(axis=1) / (
+            np.linalg.norm(embeddings, axis=1) * np.linalg.norm(reference, axis=1)
+        )
+        print(
+            f"{len(texts)} texts: cosine min={cosines.min():.4f} "
+            f"mean={cosines.mean():.4f} (threshold {PARITY_MIN_COSINE})"
+        )
+        if cosines.min() < PARITY_MIN_COSINE:
+            raise SystemExit(1)
+    else:
+        model_mb = os.path.getsize(embedder.model_path) / 1024**2
+        torch_mb = (
+            sum(p.numel() * p.element_size() for p in model.parameters()) / 1024**2
+        )
+        print(
+            f"torch fp32: {len(texts) / torch_seconds:.1f} texts/s, {torch_mb:.0f} MB weights\n"
+            f"onnx {'int8' if quantized else 'fp32'}: {len(texts) / onnx_seconds:.1f} texts/s, "
+            f"{model_mb:.0f} MB model"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,151 @@
+"""
+Assembly of retrieved chunks into the code context of a chat prompt.
+
+Chunks are taken in retrieval order until a token budget is spent. Chunks of the
+same file that overlap or touch are merged into one block, so text shared by
+neighbouring chunks is sent once. Each block is prefixed with its file path,
+line range and the symbols it covers.
+"""
+
+import logging
+import os
+
+from chunking import tokenizer
+
+logger = logging.getLogger(__name__)
+
+# Token budget of the code context. Counted with the cl100k_base tokenizer of the
+# chunker, which overestimates slightly for gpt-4o's o200k_base
+CONTEXT_MAX_TOKENS = 8000
+CONTEXT_CANDIDATES = 20  # Chunks retrieved per question, before budgeting
+
+
+class ContextBlock:
+    """A contiguous span of one file, made of one or more merged chunks."""
+
+    def __init__(self, chunk, rank):
+        self.file_path = chunk.file_path
+        self.text = chunk.text
+        self.start_char = chunk.start_char
+        self.end_char = chunk.end_char
+        self.start_line = chunk.start_line
+        self.end_line = chunk.end_line
+        self.symbols = [chunk.symbol] if chunk.symbol else []
+        self.rank = rank  # Best retrieval rank of its chunks
+
+    def touches(self, chunk):
+        return (
+            chunk.file_path == self.file_path
+            and chunk.start_char <= self.end_char
+            and chunk.end_char >= self.start_char
+        )
+
+    def merged(self, span, symbols):
+        """
+        Copy of this block extended by an overlapping or touching span, which is
+        a chunk or another block.
+        """
+        block = ContextBlock.__new__(ContextBlock)
+        block.__dict__.update(self.__dict__)
+        block.symbols = list(self.symbols)
+        if span.start_char < block.start_char:
+            block.text = span.text[: block.start_char - span.start_char] + block.text
+            block.start_char = span.start_char
+            block.start_line = span.start_line
+        if span.end_char > block.end_char:
+            block.text += span.text[block.end_char - span.start_char :]
+            block.end_char = span.end_char
+            block.end_line = span.end_line
+        block.symbols.extend(
+            symbol for symbol in symbols if symbol not in block.symbols
+        )
+        return block
+
+    def render(self, repo_path=None):
+        path = self.file_path
+        if repo_path:
+            path = os.path.relpath(path, repo_path)
+        header = f"File: {path} (lines {self.start_line}-{self.end_line})"
+        if self.symbols:
+            header += f" [{', '.join(self.symbols)}]"
+        return f"{header}\n```\n{self.text}\n```"
+
+
+def count_tokens(text):
+    return len(tokenizer.encode_ordinary(text))
+
+
+def build_context(chunks, max_tokens=CONTEXT_MAX_TOKENS, repo_path=None):
+    """
+    Fill a token budget with chunks in the order given (best match first).
+
+    A chunk that would overflow the budget is skipped, so a later, smaller one
+    may still fit. If not even the first chunk fits, it is cut to the budget,
+    or left out when its header alone is over budget. tokens_used never exceeds
+    max_tokens.
+
+    Args:
+        chunks (list): CodeChunk objects in retrieval order.
+        max_tokens (int): Token budget of the returned context.
+        repo_path (str, optional): Checkout to show file paths relative to.
+
+    Returns:
+        tuple: (context, tokens_used, chunks_used).
+    """
+    blocks = []
+    block_tokens = []
+    separator_tokens = count_tokens("\n\n")
+    tokens_used = 0
+    chunks_used = 0
+
+    for rank, chunk in enumerate(chunks):
+        # A chunk may join one block and bridge it to others of the same file
+        touching = [i for i, block in enumerate(blocks) if block.touches(chunk)]
+        if touching:
+            # The chunk spans the gap between the blocks, so it is merged first
+            block = blocks[touching[0]].merged(
+                chunk, [chunk.symbol] if chunk.symbol else []
+            )
+            for i in touching[1:]:
+                block = block.merged(blocks[i], blocks[i].symbols)
+            block.rank = min(blocks[i].rank for i in touching)
+            replaced_tokens = sum(
+                block_tokens[i] for i in touching
+            ) + separator_tokens * (len(touching) - 1)
+        else:
+            block = ContextBlock(chunk, rank)
+            replaced_tokens = -separator_tokens if blocks else 0
+
+        new_tokens = count_tokens(block.render(repo_path))
+        if tokens_used - replaced_tokens + new_tokens > max_tokens:
+            continue
+
+        for i in reversed(touching):
+            del blocks[i]
+            del block_tokens[i]
+        blocks.append(block)
+        block_tokens.append(new_tokens)
+        tokens_used += new_tokens - replaced_tokens
+        chunks_used += 1
+
+    if not blocks and chunks:
+        # The best chunk alone is over budget: keep as much of it as fits
+        block = ContextBlock(chunks[0], 0)
+        text_tokens = tokenizer.encode_ordinary(block.text)
+        header_tokens = count_tokens(block.render(repo_path)) - len(text_tokens)
+        text_budget = max_tokens - header_tokens
+        while text_budget > 0:
+            block.text = tokenizer.decode(text_tokens[:text_budget])
+            block_tokens = count_tokens(block.render(repo_path))
+            if block_tokens <= max_tokens:
+                blocks.append(block)
+                tokens_used = block_tokens
+                chunks_used = 1
+                break
+            # Tokens can merge across the cut or with the closing fence
+            text_budget -= block_tokens - max_tokens
+        # Otherwise not even the header fits, and the context stays empty
+
+    blocks.sort(key=lambda block: block.rank)
+    context = "\n\n".join(block.render(repo_path) for block in blocks)
+    return context, tokens_used, chunks_used
@@ -0,0 +1,332 @@
+"""
+SQLite cache of chunk embeddings shared by main.py, new_test.py and code_bert.py.
+
+Vectors are stored as raw float32 blobs and keyed by
+(model, dimension, chunker version, sha256 of the chunk text), so several
+embedding models can share one database file without returning each other's
+vectors. Run `python embedding_cache.py --help` for the stats and prune commands.
+"""
+
+import argparse
+import json
+import logging
+import sqlite3
+import time
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_DB_FILE = "embedding_cache.db"
+
+# Bumped whenever the on-disk layout changes; stored in PRAGMA user_version
+SCHEMA_VERSION = 2
+
+# Rows of the pre-namespaced `embeddings` table carry no model, so they are
+# attributed by vector size to the model that wrote them
+LEGACY_MODELS_BY_DIMENSION = {
+    1536: "text-embedding-3-small",
+    768: "microsoft/codebert-base",
+}
+# Legacy rows are filed under the chunker that main.py and code_bert.py still use
+# (CHUNKER_VERSION "v1"). new_test.py chunks with chunking.CHUNKER_VERSION ("v2"),
+# which produces different chunk texts, so it never hits migrated rows
+LEGACY_CHUNKER = "v1"
+
+SQLITE_BATCH_SIZE = 900  # SQLite limit is 999 variables per statement
+# last_used only drives pruning by age, so a hit rewrites it only when it is at
+# least this old; most lookups stay read-only and take no write lock
+LAST_USED_RESOLUTION_SECONDS = 86400
+
+
+def load_embedding_cache(db_file=DEFAULT_DB_FILE):
+    conn = sqlite3.connect(db_file)
+    cursor = conn.cursor()
+    # Create table if it doesn't exist
+    cursor.execute(
+        """
+        CREATE TABLE IF NOT EXISTS embedding_cache (
+            model TEXT NOT NULL,
+            dimension INTEGER NOT NULL,
+            chunker TEXT NOT NULL,
+            hash TEXT NOT NULL,
+            embedding BLOB NOT NULL,
+            created_at REAL NOT NULL,
+            last_used REAL NOT NULL,
+            PRIMARY KEY (model, dimension, chunker, hash)
+        ) WITHOUT ROWID
+    """
+    )
+
+    cursor.execute("PRAGMA user_version")
+    if cursor.fetchone()[0] < SCHEMA_VERSION:
+        migrate_legacy_cache(conn)
+    return conn, cursor
+
+
+def migrate_legacy_cache(conn, batch_size=1000):
+    """
+    Move rows of the old `embeddings(hash, embedding)` table, stored either as JSON
+    text or float32 blobs, into the namespaced table and drop the old one.
+
+    Rows are filed under LEGACY_CHUNKER ("v1"), so only main.py and code_bert.py
+    reuse them; new_test.py's "v2" chunks have other texts and hashes.
+    """
+    cursor = conn.cursor()
+    cursor.execute(
+        "SELECT name FROM sqlite_master WHERE type = 'table' AND name = 'embeddings'"
+    )
+    migrated = 0
+    skipped = 0
+    if cursor.fetchone():
+        now = time.time()
+        read_cursor = conn.cursor()
+        read_cursor.execute("SELECT hash, embedding FROM embeddings")
+        while True:
+            rows = read_cursor.fetchmany(batch_size)
+            if not rows:
+                break
+            insert_data = []
+            for chunk_hash, embedding in rows:
+                if isinstance(embedding, str):
+                    vector = np.asarray(json.loads(embedding), dtype=np.float32)
+                else:
+                    vector = np.frombuffer(embedding, dtype=np.float32)
+                model = LEGACY_MODELS_BY_DIMENSION.get(len(vector))
+                if model is None:
+                    skipped += 1
+                    continue
+                insert_data.append(
+                    (
+                        model,
+                        len(vector),
+                        LEGACY_CHUNKER,
+                        chunk_hash,
+                        vector.tobytes(),
+                        now,
+                        now,
+                    )
+                )
+            cursor.executemany(
+                "INSERT OR IGNORE INTO embedding_cache VALUES (?, ?, ?, ?, ?, ?, ?)",
+                insert_data,
+            )
+            migrated += len(insert_data)
+        cursor.execute("DROP TABLE embeddings")
+
+    cursor.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+    conn.commit()
+    if migrated or skipped:
+        logger.info(
+            f"Migrated {migrated} cached embeddings to the namespaced cache "
+            f"({skipped} of unknown dimension dropped)"
+        )
+
+
+def lookup_embeddings(cursor, model, dimension, chunker, hashes):
+    """
+    Look up cached vectors for the given chunk hashes.
+
+    last_used is refreshed only for hits whose stamp is older than
+    LAST_USED_RESOLUTION_SECONDS, in one write at the end, so repeated lookups
+    don't turn every cache hit into a write transaction.
+
+    Returns:
+        list: (hash, np.ndarray) pairs for the hashes found in the namespace.
+    """
+    found = []
+    stale = []
+    now = time.time()
+    stale_before = now - LAST_USED_RESOLUTION_SECONDS
+    key = (model, dimension, chunker)
+    for i in range(0, len(hashes), SQLITE_BATCH_SIZE):
+        batch_hashes = hashes[i : i + SQLITE_BATCH_SIZE]
+        placeholders = ",".join(["?"] * len(batch_hashes))
+        cursor.execute(
+            f"""
+            SELECT hash, embedding, last_used FROM embedding_cache
+            WHERE model = ? AND dimension = ? AND chunker = ? AND hash IN ({placeholders})
+            """,
+            (*key, *batch_hashes),
+        )
+        for chunk_hash, blob, last_used in cursor.fetchall():
+            found.append((chunk_hash, np.frombuffer(blob, dtype=np.float32)))
+            if last_used < stale_before:
+                stale.append(chunk_hash)
+
+    if stale:
+        cursor.executemany(
+            """
+            UPDATE embedding_cache SET last_used = ?
+            WHERE model = ? AND dimension = ? AND chunker = ? AND hash = ?
+            """,
+            [(now, *key, chunk_hash) for chunk_hash in stale],
+        )
+        # Release the write lock right away so other processes aren't blocked
+        cursor.connection.commit()
+    return found
+
+
+def store_embeddings(cursor, model, dimension, chunker, items):
+    """
+    Insert (hash, vector) pairs into the namespace.
+
+    Raises:
+        ValueError: If a vector does not have the namespace's dimension.
+    """
+    now = time.time()
+    insert_data = []
+    for chunk_hash, vector in items:
+        vector = np.asarray(vector, dtype=np.float32)
+        if vector.shape != (dimension,):
+            raise ValueError(
+                f"Embedding of shape {vector.shape} does not match {model} ({dimension})"
+            )
+        insert_data.append(
+            (model, dimension, chunker, chunk_hash, vector.tobytes(), now, now)
+        )
+    cursor.executemany(
+        "INSERT OR REPLACE INTO embedding_cache VALUES (?, ?, ?, ?, ?, ?, ?)",
+        insert_data,
+    )
+
+
+def export_embeddings(db_file, model, dimension, chunker=None):
+    """
+    Every cached vector of a model and dimension, optionally of one chunker only.
+
+    Returns:
+        np.ndarray: float32 matrix of shape (rows, dimension).
+    """
+    conn, cursor = load_embedding_cache(db_file)
+    query = "SELECT embedding FROM embedding_cache WHERE model = ? AND dimension = ?"
+    params = [model, dimension]
+    if chunker is not None:
+        query += " AND chunker = ?"
+        params.append(chunker)
+    cursor.execute(query, params)
+    blobs = [row[0] for row in cursor.fetchall()]
+    conn.close()
+    return np.frombuffer(b"".join(blobs), dtype=np.float32).reshape(-1, dimension)
+
+
+def cache_stats(db_file=DEFAULT_DB_FILE):
+    """Row count, size and age of the cache per (model, dimension, chunker)."""
+    conn, cursor = load_embedding_cache(db_file)
+    cursor.execute(
+        """
+        SELECT model, dimension, chunker, COUNT(*), SUM(LENGTH(embedding)),
+               MIN(created_at), MAX(last_used)
+        FROM embedding_cache
+        GROUP BY model, dimension, chunker
+        ORDER BY model, dimension, chunker
+    """
+    )
+    stats = [
+        {
+            "model": model,
+            "dimension": dimension,
+            "chunker": chunker,
+            "count": count,
+            "bytes": size,
+            "oldest": oldest,
+            "last_used": last_used,
+        }
+        for model, dimension, chunker, count, size, oldest, last_used in cursor.fetchall()
+    ]
+    conn.close()
+    return stats
+
+
+def prune_cache(
+    db_file=DEFAULT_DB_FILE,
+    model=None,
+    dimension=None,
+    chunker=None,
+    unused_days=None,
+    vacuum=False,
+):
+    """
+    Delete cached embeddings matching every given filter.
+
+    Args:
+        model (str, optional): Only prune this model.
+        dimension (int, optional): Only prune vectors of this dimension.
+        chunker (str, optional): Only prune this chunker version.
+        unused_days (float, optional): Only prune rows not used for this many days.
+        vacuum (bool): Reclaim the freed space on disk afterwards.
+
+    Returns:
+        int: Number of rows deleted.
+    """
+    conditions = []
+    params = []
+    if model is not None:
+        conditions.append("model = ?")
+        params.append(model)
+    if dimension is not None:
+        conditions.append("dimension = ?")
+        params.append(dimension)
+    if chunker is not None:
+        conditions.append("chunker = ?")
+        params.append(chunker)
+    if unused_days is not None:
+        conditions.append("last_used < ?")
+        params.append(time.time() - unused_days * 86400)
+    if not conditions:
+        raise ValueError("Refusing to prune the whole cache without a filter")
+
+    conn, cursor = load_embedding_cache(db_file)
+    cursor.execute(
+        f"DELETE FROM embedding_cache WHERE {' AND '.join(conditions)}", params
+    )
+    deleted = cursor.rowcount
+    conn.commit()
+    if vacuum:
+        conn.execute("VACUUM")
+    conn.close()
+    logger.info(f"Pruned {deleted} cached embeddings from {db_file}")
+    return deleted
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Inspect or prune the embedding cache")
+    parser.add_argument("--db-file", default=DEFAULT_DB_FILE)
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    subparsers.add_parser("stats", help="Show per-model cache statistics")
+
+    prune = subparsers.add_parser("prune", help="Delete matching cache entries")
+    prune.add_argument("--model")
+    prune.add_argument("--dimension", type=int)
+    prune.add_argument("--chunker")
+    prune.add_argument("--unused-days", type=float)
+    prune.add_argument("--vacuum", action="store_true")
+
+    args = parser.parse_args()
+    if args.command == "stats":
+        for row in cache_stats(args.db_file):
+            print(
+                f"{row['model']:<32} dim={row['dimension']:<5} chunker={row['chunker']:<8} "
+                f"rows={row['count']:<8} size={row['bytes'] / 1024**2:.1f} MB"
+            )
+    else:
+        filters = (args.model, args.dimension, args.chunker, args.unused_days)
+        if all(value is None for value in filters):
+            parser.error(
+                "prune needs at least one of --model, --dimension, --chunker, --unused-days"
+            )
+        deleted = prune_cache(
+            args.db_file,
+            model=args.model,
+            dimension=args.dimension,
+            chunker=args.chunker,
+            unused_days=args.unused_days,
+            vacuum=args.vacuum,
+        )
+        print(f"Deleted {deleted} rows")
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    main()
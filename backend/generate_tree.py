@@ -1,11 +1,16 @@
+import concurrent.futures
+import importlib
 import json
+import multiprocessing
 import os
 import shutil
 import time
 
-import git
+from clone_repo import DEFAULT_CLONE_STRATEGY, clone_with_strategy
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse
+from jobs import JobQueue, add_progress, job_stage, set_progress
 from pydantic import BaseModel
 from tree_sitter import Language, Parser
 
@@ -27,7 +32,7 @@ app.add_middleware(
 
 
 # Step 1: Clone the repository
-def clone_repository(repo_url, clone_dir="repo"):
+def clone_repository(repo_url, clone_dir="repo", clone_strategy=DEFAULT_CLONE_STRATEGY):
     try:
         shutil.rmtree(clone_dir)
     except FileNotFoundError:
@@ -36,24 +41,30 @@ def clone_repository(repo_url, clone_dir="repo"):
     if os.path.exists(clone_dir):
         print(f"Repository already cloned in {clone_dir}")
     else:
-        git.Repo.clone_from(repo_url, clone_dir)
+        # Only the files we can parse are needed for a sparse checkout
+        clone_with_strategy(
+            repo_url, clone_dir, clone_strategy, tuple(EXTENSION_LANGUAGE_MAP)
+        )
         print(f"Cloned repository into {clone_dir}")
     return clone_dir
 
 
-# Step 2: Build language parsers
-def build_language_parsers(languages, output_path="build/my-languages.so"):
-    if not os.path.exists("build"):
-        os.mkdir("build")
-    language_so_paths = []
-    for lang, repo in languages.items():
-        lang_dir = f"build/tree-sitter-{lang}"
-        if not os.path.exists(lang_dir):
-            print(f"Cloning grammar for {lang}")
-            git.Repo.clone_from(repo, lang_dir)
-        language_so_paths.append(f"{lang_dir}")
-    Language.build_library(output_path, language_so_paths)
-    return output_path
+# Step 2: Load language parsers
+# Languages to support, with the grammar package of each (see requirements.txt)
+LANGUAGES = {
+    "python": "tree_sitter_python",
+    "javascript": "tree_sitter_javascript",
+    "cpp": "tree_sitter_cpp",
+    # Add more as needed
+}
+
+
+def load_language_map(languages=LANGUAGES):
+    """Load the precompiled tree-sitter language of each grammar package."""
+    return {
+        lang: Language(importlib.import_module(module).language())
+        for lang, module in languages.items()
+    }
 
 
 # Step 3: Get all files in the repository
@@ -89,8 +100,7 @@ def detect_language(file_path):
 
 # Step 5: Parse files into ASTs
 def parse_file(file_path, language, LANGUAGE_MAP):
-    parser = Parser()
-    parser.set_language(LANGUAGE_MAP[language])
+    parser = Parser(LANGUAGE_MAP[language])
 
     with open(file_path, "r", encoding="utf-8") as f:
         code = f.read()
@@ -114,54 +124,103 @@ def node_to_dict(node, code):
     return node_dict
 
 
-# Main function
-async def main(repoInfo: AstItem):
-    start_time = time.time()
-    # Replace with your repository URL
-    print("repo", repoInfo.repoName)
-    repo_path = clone_repository(repoInfo.repoName)
-
-    # Languages to support
-    LANGUAGES = {
-        "python": "https://github.com/tree-sitter/tree-sitter-python",
-        "javascript": "https://github.com/tree-sitter/tree-sitter-javascript",
-        "cpp": "https://github.com/tree-sitter/tree-sitter-cpp",
-        # Add more as needed
-    }
+# Parse in worker processes once a repository has more files than one batch
+PARSE_PROCESS_WORKERS = os.cpu_count() or 1
+PARSE_FILES_PER_BATCH = 64
 
-    # Build language parsers
-    library_path = build_language_parsers(LANGUAGES)
+_worker_language_map = None
 
-    # Load the compiled languages
-    LANGUAGE_MAP = {}
-    for lang in LANGUAGES.keys():
-        LANGUAGE_MAP[lang] = Language(library_path, lang)
 
-    # Get all files
-    all_files = get_all_files(repo_path)
+# Step 6: Parse a file and save its AST as JSON
+def save_ast(file_path, repo_path, language, LANGUAGE_MAP, output_dir="asts"):
+    tree, code = parse_file(file_path, language, LANGUAGE_MAP)
 
-    # Parse files and save ASTs
-    for file_path in all_files:
-        language = detect_language(file_path)
-        if language:
-            print(f"Parsing {file_path} as {language}")
-            tree, code = parse_file(file_path, language, LANGUAGE_MAP)
+    # Convert AST to dict
+    ast_dict = node_to_dict(tree.root_node, code)
+
+    # Define output path
+    relative_path = os.path.relpath(file_path, repo_path)
+    json_output_path = os.path.join(output_dir, f"{relative_path}.json")
 
-            # Convert AST to dict
-            ast_dict = node_to_dict(tree.root_node, code)
+    # Ensure the output directory exists
+    os.makedirs(os.path.dirname(json_output_path), exist_ok=True)
 
-            # Define output path
-            relative_path = os.path.relpath(file_path, repo_path)
-            json_output_path = os.path.join("asts", f"{relative_path}.json")
+    # Save AST to JSON file
+    with open(json_output_path, "w", encoding="utf-8") as json_file:
+        json.dump(ast_dict, json_file, indent=2, ensure_ascii=False)
 
-            # Ensure the output directory exists
-            os.makedirs(os.path.dirname(json_output_path), exist_ok=True)
+    return json_output_path
 
-            # Save AST to JSON file
-            with open(json_output_path, "w", encoding="utf-8") as json_file:
-                json.dump(ast_dict, json_file, indent=2, ensure_ascii=False)
 
-            print(f"Saved AST to {json_output_path}")
+def save_ast_batch(file_paths, repo_path, output_dir="asts"):
+    """Worker task: parse and save a batch of files, loading the parsers once per process."""
+    global _worker_language_map
+    if _worker_language_map is None:
+        _worker_language_map = load_language_map()
+
+    saved = []
+    for file_path in file_paths:
+        language = detect_language(file_path)
+        if language:
+            saved.append(
+                save_ast(
+                    file_path, repo_path, language, _worker_language_map, output_dir
+                )
+            )
+    return saved
+
+
+# Main function
+def main(repoInfo: AstItem, workers=PARSE_PROCESS_WORKERS):
+    start_time = time.time()
+    # Replace with your repository URL
+    print("repo", repoInfo.repoName)
+    with job_stage("clone"):
+        repo_path = clone_repository(repoInfo.repoName)
+
+    # Load the language parsers before any worker needs them
+    with job_stage("parsers"):
+        LANGUAGE_MAP = load_language_map()
+
+    with job_stage("parse"):
+        # Get all files
+        all_files = [
+            file_path
+            for file_path in get_all_files(repo_path)
+            if detect_language(file_path)
+        ]
+        set_progress(files_total=len(all_files), files_parsed=0)
+
+        if workers > 1 and len(all_files) > PARSE_FILES_PER_BATCH:
+            # Parse batches of files in worker processes and report them as they finish
+            batches = [
+                all_files[i : i + PARSE_FILES_PER_BATCH]
+                for i in range(0, len(all_files), PARSE_FILES_PER_BATCH)
+            ]
+            with concurrent.futures.ProcessPoolExecutor(
+                max_workers=min(workers, len(batches)),
+                mp_context=multiprocessing.get_context("spawn"),
+            ) as executor:
+                futures = [
+                    executor.submit(save_ast_batch, batch, repo_path)
+                    for batch in batches
+                ]
+                for future in concurrent.futures.as_completed(futures):
+                    saved = future.result()
+                    add_progress(files_parsed=len(saved))
+                    print(
+                        f"Saved {len(saved)} ASTs, last: {saved[-1] if saved else None}"
+                    )
+        else:
+            # Parse files and save ASTs
+            for file_path in all_files:
+                language = detect_language(file_path)
+                print(f"Parsing {file_path} as {language}")
+                json_output_path = save_ast(
+                    file_path, repo_path, language, LANGUAGE_MAP
+                )
+                add_progress(files_parsed=1)
+                print(f"Saved AST to {json_output_path}")
 
     end_time = time.time()
 
@@ -172,16 +231,21 @@ if __name__ == "__main__":
     main()
 
 
+# AST jobs share the "repo" checkout and "asts" output, so they run one at a time
+ast_jobs = JobQueue(max_workers=1)
+
+
 @app.post("/generateast")
 async def generateAst(repoInfo: AstItem):
     print(repoInfo)
-    try:
+    # Parsing runs in the background; poll /jobs/{job_id} for progress
+    job = ast_jobs.submit("generateast", main, repoInfo, key=repoInfo.repoName)
+    return {"job_id": job.id, "status": job.status}
 
-        start_t = time.time()
-        await main(repoInfo)
-        end_t = time.time()
-        print("TOTAL TIME:", end_t - start_t)
 
-        return {"success:": "success"}
-    except Exception as e:
-        return {"error": str(e)}
+@app.get("/jobs/{job_id}")
+async def job_status(job_id: str):
+    job = ast_jobs.get(job_id)
+    if job is None:
+        return JSONResponse({"error": f"Unknown job {job_id}"}, status_code=404)
+    return job.to_dict()
@@ -0,0 +1,220 @@
+"""
+On-disk store of built FAISS indexes and their chunk metadata.
+
+Each repository gets a directory named after the sha256 hash of its URL. Inside,
+every (embedding model, chunker version) namespace has one index built at one
+commit:
+
+    indexes/<repo hash>/<commit>-<namespace>.faiss   faiss.write_index output
+    indexes/<repo hash>/<commit>-<namespace>.json    chunk metadata sidecar
+    indexes/<repo hash>/<commit>-<namespace>.lex.npz lexical (BM25) index
+    indexes/<repo hash>/latest.json                  namespace -> commit
+
+Chunk paths are stored relative to the checkout so the index stays valid when
+the clone directory moves.
+"""
+
+import hashlib
+import json
+import logging
+import os
+import time
+from threading import Lock
+
+import faiss
+from chunking import CodeChunk
+from lexical_index import LexicalIndex
+
+logger = logging.getLogger(__name__)
+
+INDEX_STORE_DIR = "indexes"
+
+# Bumped whenever the sidecar layout changes; older sidecars are ignored
+SIDECAR_VERSION = 1
+
+_store_lock = Lock()
+
+
+def repo_store_dir(repo_url, store_dir=INDEX_STORE_DIR):
+    repo_hash = hashlib.sha256(repo_url.encode()).hexdigest()[:10]
+    return os.path.join(store_dir, repo_hash)
+
+
+def index_namespace(model, chunker):
+    return f"{model.replace('/', '_')}-{chunker}"
+
+
+def _write_atomic(path, write):
+    tmp_path = f"{path}.tmp"
+    write(tmp_path)
+    os.replace(tmp_path, path)
+
+
+def _read_pointer(repo_dir):
+    try:
+        with open(os.path.join(repo_dir, "latest.json"), "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def save_repo_index(
+    repo_url,
+    commit,
+    faiss_index,
+    code_chunks,
+    repo_path,
+    model,
+    chunker,
+    lexical_index=None,
+    store_dir=INDEX_STORE_DIR,
+):
+    """
+    Write the index and chunk metadata of repo_url at commit, then point the
+    namespace at them and delete the files of the commit it pointed to before.
+
+    Args:
+        repo_url (str): Repository the index was built for.
+        commit (str): Commit the chunks were read at.
+        faiss_index (faiss.Index): Index whose id i is code_chunks[i].
+        code_chunks (list): CodeChunk objects with paths under repo_path.
+        repo_path (str): Checkout the chunks were read from.
+        model (str): Embedding model of the vectors.
+        chunker (str): Chunker version the chunks were produced with.
+        lexical_index (LexicalIndex, optional): Lexical index over code_chunks.
+    """
+    start_time = time.time()
+    repo_dir = repo_store_dir(repo_url, store_dir)
+    namespace = index_namespace(model, chunker)
+    base_path = os.path.join(repo_dir, f"{commit}-{namespace}")
+    os.makedirs(repo_dir, exist_ok=True)
+
+    # Column-oriented, with each file path stored once
+    files = []
+    file_ids = {}
+    columns = {field: [] for field in CodeChunk._fields}
+    for chunk in code_chunks:
+        relative_path = os.path.relpath(chunk.file_path, repo_path)
+        if relative_path not in file_ids:
+            file_ids[relative_path] = len(files)
+            files.append(relative_path)
+        columns["file_path"].append(file_ids[relative_path])
+        for field in CodeChunk._fields[1:]:
+            columns[field].append(getattr(chunk, field))
+    sidecar = {
+        "version": SIDECAR_VERSION,
+        "repo_url": repo_url,
+        "commit": commit,
+        "model": model,
+        "chunker": chunker,
+        "ntotal": faiss_index.ntotal,
+        "files": files,
+        "chunks": columns,
+    }
+
+    def write_sidecar(path):
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(sidecar, f, ensure_ascii=False, separators=(",", ":"))
+
+    with _store_lock:
+        _write_atomic(
+            f"{base_path}.faiss", lambda path: faiss.write_index(faiss_index, path)
+        )
+        if lexical_index is not None:
+            _write_atomic(f"{base_path}.lex.npz", lexical_index.save)
+        _write_atomic(f"{base_path}.json", write_sidecar)
+
+        pointer = _read_pointer(repo_dir)
+        previous_commit = pointer.get(namespace)
+        pointer[namespace] = commit
+
+        def write_pointer(path):
+            with open(path, "w", encoding="utf-8") as f:
+                json.dump(pointer, f)
+
+        _write_atomic(os.path.join(repo_dir, "latest.json"), write_pointer)
+
+        if previous_commit and previous_commit != commit:
+            for extension in (".faiss", ".json", ".lex.npz"):
+                try:
+                    os.remove(
+                        os.path.join(
+                            repo_dir, f"{previous_commit}-{namespace}{extension}"
+                        )
+                    )
+                except FileNotFoundError:
+                    pass
+
+    logger.info(
+        f"Saved index of {repo_url} at {commit[:7]} in "
+        f"{time.time() - start_time:.2f} seconds"
+    )
+
+
+def load_repo_index(
+    repo_url, repo_path, model, chunker, mmap=True, store_dir=INDEX_STORE_DIR
+):
+    """
+    Load the latest stored index of repo_url for a model and chunker version.
+
+    Args:
+        repo_url (str): Repository to load.
+        repo_path (str): Checkout the chunk paths are resolved against.
+        model (str): Embedding model the index must have been built with.
+        chunker (str): Chunker version the chunks must have been built with.
+        mmap (bool): Memory-map the index file instead of reading it into memory.
+
+    Returns:
+        tuple: (faiss_index, code_chunks, commit, lexical_index), or None if nothing
+            usable is stored. lexical_index is None if none was stored.
+    """
+    start_time = time.time()
+    repo_dir = repo_store_dir(repo_url, store_dir)
+    namespace = index_namespace(model, chunker)
+    commit = _read_pointer(repo_dir).get(namespace)
+    if commit is None:
+        return None
+
+    base_path = os.path.join(repo_dir, f"{commit}-{namespace}")
+    try:
+        with open(f"{base_path}.json", "r", encoding="utf-8") as f:
+            sidecar = json.load(f)
+        if sidecar.get("version") != SIDECAR_VERSION:
+            logger.info(f"Ignoring stored index of {repo_url} with an old layout")
+            return None
+
+        io_flags = faiss.IO_FLAG_MMAP | faiss.IO_FLAG_READ_ONLY if mmap else 0
+        faiss_index = faiss.read_index(f"{base_path}.faiss", io_flags)
+    except (OSError, ValueError, RuntimeError) as e:
+        logger.error(f"Error loading stored index of {repo_url}: {e}")
+        return None
+
+    files = [os.path.join(repo_path, path) for path in sidecar["files"]]
+    columns = sidecar["chunks"]
+    columns["file_path"] = [files[file_id] for file_id in columns["file_path"]]
+    code_chunks = [
+        CodeChunk(*values)
+        for values in zip(*(columns[field] for field in CodeChunk._fields))
+    ]
+    if len(code_chunks) != faiss_index.ntotal:
+        logger.error(
+            f"Stored index of {repo_url} has {faiss_index.ntotal} vectors "
+            f"for {len(code_chunks)} chunks; ignoring it"
+        )
+        return None
+
+    lexical_index = None
+    try:
+        lexical_index = LexicalIndex.load(f"{base_path}.lex.npz")
+    except FileNotFoundError:
+        pass
+    except (OSError, ValueError, KeyError) as e:
+        logger.error(f"Error loading stored lexical index of {repo_url}: {e}")
+    if lexical_index is not None and len(lexical_index) != len(code_chunks):
+        lexical_index = None
+
+    logger.info(
+        f"Loaded index of {repo_url} at {commit[:7]} ({len(code_chunks)} chunks) in "
+        f"{time.time() - start_time:.3f} seconds"
+    )
+    return faiss_index, code_chunks, commit, lexical_index
@@ -0,0 +1,176 @@
+"""
+Background jobs with per-stage progress, used by the indexing endpoints.
+
+A JobQueue runs submitted functions on a bounded pool of worker threads. While
+a job runs, the pipeline code it calls reports progress through job_stage(),
+set_progress() and add_progress(); outside of a job those calls do nothing, so
+the same functions still work when called directly.
+"""
+
+import contextvars
+import logging
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from threading import Lock
+
+logger = logging.getLogger(__name__)
+
+JOB_WORKERS = 2  # Jobs running at once per queue
+JOB_RETENTION_SECONDS = 60 * 60  # How long finished jobs stay queryable
+
+_current_job = contextvars.ContextVar("current_job", default=None)
+
+
+class Job:
+    """State of one submitted job. Progress is kept per stage, in stage order."""
+
+    def __init__(self, kind, key=None):
+        self.id = uuid.uuid4().hex
+        self.kind = kind
+        self.key = key
+        self.status = "queued"  # queued, running, succeeded or failed
+        self.error = None
+        self.stages = {}
+        self.current_stage = None
+        self.created_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+        self.lock = Lock()
+
+    @property
+    def done(self):
+        return self.status in ("succeeded", "failed")
+
+    def start_stage(self, name):
+        with self.lock:
+            self.current_stage = name
+            self.stages[name] = {"status": "running", "started_at": time.time()}
+
+    def finish_stage(self, name, status="done"):
+        with self.lock:
+            stage = self.stages[name]
+            stage["status"] = status
+            stage["seconds"] = time.time() - stage["started_at"]
+
+    def set_progress(self, **values):
+        with self.lock:
+            self.stages.setdefault(self.current_stage, {}).update(values)
+
+    def add_progress(self, **counters):
+        with self.lock:
+            stage = self.stages.setdefault(self.current_stage, {})
+            for name, value in counters.items():
+                stage[name] = stage.get(name, 0) + value
+
+    def to_dict(self):
+        with self.lock:
+            return {
+                "job_id": self.id,
+                "kind": self.kind,
+                "status": self.status,
+                "error": self.error,
+                "current_stage": self.current_stage,
+                "stages": {name: dict(stage) for name, stage in self.stages.items()},
+                "created_at": self.created_at,
+                "started_at": self.started_at,
+                "finished_at": self.finished_at,
+            }
+
+
+@contextmanager
+def job_stage(name):
+    """Mark a stage of the current job as running for the duration of the block."""
+    job = _current_job.get()
+    if job is None:
+        yield
+        return
+    job.start_stage(name)
+    try:
+        yield
+    except BaseException:
+        job.finish_stage(name, "failed")
+        raise
+    job.finish_stage(name)
+
+
+def set_progress(**values):
+    """Set counters of the current job's running stage."""
+    job = _current_job.get()
+    if job is not None:
+        job.set_progress(**values)
+
+
+def add_progress(**counters):
+    """Increment counters of the current job's running stage."""
+    job = _current_job.get()
+    if job is not None:
+        job.add_progress(**counters)
+
+
+class JobQueue:
+    """
+    Runs jobs on max_workers threads; further jobs wait in the queue.
+
+    Jobs submitted with a key (e.g. a repository URL) are deduplicated: while a
+    job with the same kind and key is queued or running, submitting another one
+    returns the existing job.
+    """
+
+    def __init__(
+        self, max_workers=JOB_WORKERS, retention_seconds=JOB_RETENTION_SECONDS
+    ):
+        self.retention_seconds = retention_seconds
+        self._executor = ThreadPoolExecutor(
+            max_workers=max_workers, thread_name_prefix="job"
+        )
+        self._jobs = {}
+        self._lock = Lock()
+
+    def submit(self, kind, fn, *args, key=None, **kwargs):
+        """
+        Queue fn(*args, **kwargs) as a job.
+
+        Returns:
+            Job: The new job, or the active job with the same kind and key.
+        """
+        with self._lock:
+            self._prune()
+            if key is not None:
+                for job in self._jobs.values():
+                    if job.kind == kind and job.key == key and not job.done:
+                        return job
+            job = Job(kind, key)
+            self._jobs[job.id] = job
+
+        self._executor.submit(self._run, job, fn, args, kwargs)
+        logger.info(f"Queued {kind} job {job.id}")
+        return job
+
+    def get(self, job_id):
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def _run(self, job, fn, args, kwargs):
+        token = _current_job.set(job)
+        job.status = "running"
+        job.started_at = time.time()
+        try:
+            fn(*args, **kwargs)
+        except Exception as e:
+            logger.error(f"{job.kind} job {job.id} failed: {e}", exc_info=True)
+            job.error = str(e)
+            job.finished_at = time.time()
+            job.status = "failed"
+        else:
+            job.finished_at = time.time()
+            job.status = "succeeded"
+        finally:
+            _current_job.reset(token)
+
+    def _prune(self):
+        cutoff = time.time() - self.retention_seconds
+        for job_id, job in list(self._jobs.items()):
+            if job.done and job.finished_at < cutoff:
+                del self._jobs[job_id]
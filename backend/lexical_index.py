@@ -0,0 +1,187 @@
+"""
+BM25 inverted index over chunk texts, for identifier-heavy questions.
+
+Text is tokenized into identifiers and numbers. Each identifier is indexed both
+whole and split on snake_case and camelCase boundaries, so a question mentioning
+`clone_github_repo_private` matches that identifier exactly while "private repo
+clone" still matches its parts. Postings are stored as flat numpy arrays (CSR
+layout), which keeps the index compact in memory and on disk.
+"""
+
+import logging
+import math
+import re
+import time
+from collections import Counter
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+BM25_K1 = 1.2  # Term frequency saturation
+BM25_B = 0.75  # Document length normalization
+RRF_K = 60  # Reciprocal rank fusion damping; higher flattens rank differences
+MIN_TOKEN_LENGTH = 2  # Shorter tokens are not indexed
+
+_IDENTIFIER_RE = re.compile(r"[A-Za-z_][A-Za-z0-9_]*|[0-9]+")
+_CAMEL_RE = re.compile(r"[A-Z]+(?=[A-Z][a-z])|[A-Z]?[a-z]+|[A-Z]+|[0-9]+")
+
+
+def split_identifiers(text):
+    """
+    Lower-cased index terms of text: every identifier plus its snake_case and
+    camelCase parts, e.g. getHTTPResponse -> gethttpresponse, get, http, response.
+    """
+    terms = []
+    for identifier in _IDENTIFIER_RE.findall(text):
+        parts = [
+            part for word in identifier.split("_") for part in _CAMEL_RE.findall(word)
+        ]
+        if len(parts) > 1 or (parts and parts[0] != identifier):
+            terms.append(identifier.lower())
+        terms.extend(part.lower() for part in parts)
+    return [term for term in terms if len(term) >= MIN_TOKEN_LENGTH]
+
+
+class LexicalIndex:
+    """
+    BM25 index over a list of documents; document i is chunk i of the FAISS index.
+
+    Use LexicalIndex.build() to index texts and save()/load() to persist it.
+    """
+
+    def __init__(self, vocabulary, offsets, doc_ids, term_freqs, doc_lengths):
+        self.vocabulary = vocabulary  # term -> term id
+        self.offsets = offsets  # Postings of term t are [offsets[t], offsets[t + 1])
+        self.doc_ids = doc_ids
+        self.term_freqs = term_freqs
+        self.doc_lengths = doc_lengths
+        average_length = float(doc_lengths.mean()) if len(doc_lengths) else 0.0
+        self._length_norm = BM25_K1 * (
+            1 - BM25_B + BM25_B * doc_lengths / max(average_length, 1.0)
+        ).astype(np.float32)
+
+    @classmethod
+    def build(cls, texts):
+        start_time = time.time()
+        vocabulary = {}
+        term_ids = []
+        doc_ids = []
+        term_freqs = []
+        doc_lengths = []
+        for doc_id, text in enumerate(texts):
+            terms = split_identifiers(text)
+            doc_lengths.append(len(terms))
+            for term, count in Counter(terms).items():
+                term_ids.append(vocabulary.setdefault(term, len(vocabulary)))
+                doc_ids.append(doc_id)
+                term_freqs.append(count)
+
+        term_ids = np.array(term_ids, dtype=np.int32)
+        order = np.argsort(term_ids, kind="stable")  # Keeps doc ids sorted per term
+        offsets = np.zeros(len(vocabulary) + 1, dtype=np.int64)
+        np.cumsum(np.bincount(term_ids, minlength=len(vocabulary)), out=offsets[1:])
+        index = cls(
+            vocabulary,
+            offsets,
+            np.array(doc_ids, dtype=np.int32)[order],
+            np.minimum(term_freqs, np.iinfo(np.uint16).max).astype(np.uint16)[order],
+            np.array(doc_lengths, dtype=np.int32),
+        )
+        logger.info(
+            f"Built lexical index of {len(doc_lengths)} chunks and "
+            f"{len(vocabulary)} terms in {time.time() - start_time:.2f} seconds"
+        )
+        return index
+
+    def __len__(self):
+        return len(self.doc_lengths)
+
+    @property
+    def nbytes(self):
+        postings = self.offsets.nbytes + self.doc_ids.nbytes + self.term_freqs.nbytes
+        lengths = self.doc_lengths.nbytes + self._length_norm.nbytes
+        # Rough size of the vocabulary dict and its strings
+        vocabulary = sum(len(term) + 80 for term in self.vocabulary)
+        return postings + lengths + vocabulary
+
+    def search(self, query, k=10, ids=None):
+        """
+        Return up to k (doc_id, score) pairs for query, best first.
+
+        Only documents sharing at least one term with the query are returned,
+        and only those in ids when it is given.
+        """
+        num_docs = len(self.doc_lengths)
+        scores = np.zeros(num_docs, dtype=np.float32)
+        length_norm = self._length_norm
+        matched = False
+        for term in set(split_identifiers(query)):
+            term_id = self.vocabulary.get(term)
+            if term_id is None:
+                continue
+            start, end = self.offsets[term_id], self.offsets[term_id + 1]
+            docs = self.doc_ids[start:end]
+            freqs = self.term_freqs[start:end].astype(np.float32)
+            idf = math.log(1 + (num_docs - len(docs) + 0.5) / (len(docs) + 0.5))
+            scores[docs] += idf * freqs * (BM25_K1 + 1) / (freqs + length_norm[docs])
+            matched = True
+        if not matched:
+            return []
+
+        if ids is not None:
+            scope = np.zeros(num_docs, dtype=bool)
+            scope[ids] = True
+            scores[~scope] = 0
+        candidates = np.flatnonzero(scores)
+        if len(candidates) > k:
+            candidates = candidates[np.argpartition(-scores[candidates], k)[:k]]
+        candidates = candidates[np.argsort(-scores[candidates], kind="stable")]
+        return [(int(doc_id), float(scores[doc_id])) for doc_id in candidates]
+
+    def save(self, path):
+        """Write the index to path as an uncompressed .npz file."""
+        # Terms never contain newlines, so the vocabulary is stored as one string
+        terms = "\n".join(sorted(self.vocabulary, key=self.vocabulary.get))
+        with open(path, "wb") as f:
+            np.savez(
+                f,
+                terms=np.frombuffer(terms.encode("utf-8"), dtype=np.uint8),
+                offsets=self.offsets,
+                doc_ids=self.doc_ids,
+                term_freqs=self.term_freqs,
+                doc_lengths=self.doc_lengths,
+            )
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as data:
+            terms = data["terms"].tobytes().decode("utf-8")
+            terms = terms.split("\n") if terms else []
+            return cls(
+                {term: term_id for term_id, term in enumerate(terms)},
+                data["offsets"],
+                data["doc_ids"],
+                data["term_freqs"],
+                data["doc_lengths"],
+            )
+
+
+def reciprocal_rank_fusion(rankings, k=RRF_K, limit=None):
+    """
+    Merge ranked lists of ids into one ranking by summing 1 / (k + rank).
+
+    Args:
+        rankings (list): Lists of ids, each best first.
+        k (int): Damping constant.
+        limit (int, optional): Number of ids to return.
+
+    Returns:
+        list: Fused ids, best first.
+    """
+    scores = {}
+    for ranking in rankings:
+        for rank, doc_id in enumerate(ranking):
+            scores[doc_id] = scores.get(doc_id, 0.0) + 1.0 / (k + rank + 1)
+    fused = sorted(scores, key=lambda doc_id: -scores[doc_id])
+    return fused[:limit] if limit is not None else fused
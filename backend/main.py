@@ -1,11 +1,9 @@
 import asyncio
 import concurrent.futures
 import hashlib
-import json
 import logging
 import os
 import shutil
-import sqlite3
 import tempfile
 import time
 from threading import Lock
@@ -17,6 +15,7 @@ import git
 import numpy as np
 import openai
 import tiktoken
+from embedding_cache import load_embedding_cache, lookup_embeddings, store_embeddings
 from tenacity import retry, stop_after_attempt, wait_random_exponential
 
 # Configure logging
@@ -146,62 +145,52 @@ def read_files(repo_path):
     return code_chunks
 
 
-@timing_decorator
-def load_embedding_cache(db_file="embedding_cache.db"):
-    conn = sqlite3.connect(db_file)
-    cursor = conn.cursor()
-    cursor.execute(
-        """
-        CREATE TABLE IF NOT EXISTS embeddings (
-            hash TEXT PRIMARY KEY,
-            embedding TEXT
-        )
-    """
-    )
-    return conn, cursor
+# Output size of each embedding model; part of the embedding cache key
+EMBEDDING_DIMENSIONS = {
+    "text-embedding-3-small": 1536,
+    "text-embedding-3-large": 3072,
+    "text-embedding-ada-002": 1536,
+}
+
+# Bump whenever read_files starts producing different chunk texts
+CHUNKER_VERSION = "v1"
 
 
 @timing_decorator
 @retry(wait=wait_random_exponential(min=1, max=60), stop=stop_after_attempt(6))
 def get_embeddings(
-    chunks, model="text-embedding-3-small", db_file="embedding_cache.db"
+    chunks,
+    model="text-embedding-3-small",
+    db_file="embedding_cache.db",
+    dimensions=None,
 ):
+    # Vectors are cached per (model, dimension, chunker version, text hash)
+    dimension = dimensions or EMBEDDING_DIMENSIONS[model]
     conn, cursor = load_embedding_cache(db_file)
-    embeddings = [None] * len(chunks)
-    chunk_hashes = []
-    chunk_texts = []
-    indices = []
 
+    embeddings = np.empty((len(chunks), dimension), dtype=np.float32)
+    filled = np.zeros(len(chunks), dtype=bool)
+
+    hash_to_indices = {}
+    hash_to_text = {}
     for idx, chunk in enumerate(chunks):
         chunk_text = chunk[1]
         chunk_hash = hashlib.sha256(chunk_text.encode("utf-8")).hexdigest()
-        chunk_hashes.append(chunk_hash)
-        chunk_texts.append(chunk_text)
-        indices.append(idx)
-
-    hash_to_embedding = {}
-    batch_size = 900
-    for i in range(0, len(chunk_hashes), batch_size):
-        batch_hashes = chunk_hashes[i : i + batch_size]
-        placeholders = ",".join(["?"] * len(batch_hashes))
-        cursor.execute(
-            f"SELECT hash, embedding FROM embeddings WHERE hash IN ({placeholders})",
-            batch_hashes,
-        )
-        rows = cursor.fetchall()
-        hash_to_embedding.update({row[0]: json.loads(row[1]) for row in rows})
-
-    texts_to_embed = []
-    indices_to_embed = []
-    hashes_to_embed = []
-
-    for idx, chunk_hash, chunk_text in zip(indices, chunk_hashes, chunk_texts):
-        if chunk_hash in hash_to_embedding:
-            embeddings[idx] = hash_to_embedding[chunk_hash]
-        else:
-            texts_to_embed.append(chunk_text)
-            indices_to_embed.append(idx)
-            hashes_to_embed.append(chunk_hash)
+        hash_to_indices.setdefault(chunk_hash, []).append(idx)
+        hash_to_text[chunk_hash] = chunk_text
+    chunk_hashes = list(hash_to_indices)
+
+    for chunk_hash, embedding in lookup_embeddings(
+        cursor, model, dimension, CHUNKER_VERSION, chunk_hashes
+    ):
+        indices = hash_to_indices[chunk_hash]
+        embeddings[indices] = embedding
+        filled[indices] = True
+
+    # Identical chunks are only embedded once
+    hashes_to_embed = [h for h in chunk_hashes if not filled[hash_to_indices[h][0]]]
+    texts_to_embed = [hash_to_text[h] for h in hashes_to_embed]
+    extra_args = {"dimensions": dimensions} if dimensions else {}
 
     if texts_to_embed:
         batch_size = 100
@@ -209,18 +198,18 @@ def get_embeddings(
             batch_texts = texts_to_embed[i : i + batch_size]
             batch_hashes = hashes_to_embed[i : i + batch_size]
             try:
-                response = openai.embeddings.create(input=batch_texts, model=model)
-                insert_data = []
-                for j, data in enumerate(response.data):
-                    idx = indices_to_embed[i + j]
-                    chunk_hash = batch_hashes[j]
-                    embedding = data.embedding
-                    embeddings[idx] = embedding
-                    # Use INSERT OR IGNORE to avoid UNIQUE constraint errors
-                    insert_data.append((chunk_hash, json.dumps(embedding)))
-                cursor.executemany(
-                    "INSERT OR IGNORE INTO embeddings (hash, embedding) VALUES (?, ?)",
-                    insert_data,
+                response = openai.embeddings.create(
+                    input=batch_texts, model=model, **extra_args
+                )
+                batch_embeddings = []
+                for chunk_hash, data in zip(batch_hashes, response.data):
+                    embedding = np.asarray(data.embedding, dtype=np.float32)
+                    indices = hash_to_indices[chunk_hash]
+                    embeddings[indices] = embedding
+                    filled[indices] = True
+                    batch_embeddings.append((chunk_hash, embedding))
+                store_embeddings(
+                    cursor, model, dimension, CHUNKER_VERSION, batch_embeddings
                 )
             except Exception as e:
                 logger.error("Error during embedding request:", exc_info=True)
@@ -228,6 +217,12 @@ def get_embeddings(
         conn.commit()
 
     conn.close()
+
+    if not filled.all():
+        # Raising lets @retry pick up the missing rows; the rest are cache hits now
+        raise RuntimeError(
+            f"Failed to embed {int((~filled).sum())} of {len(chunks)} chunks"
+        )
     return embeddings
 
 
@@ -244,8 +239,8 @@ def get_embedding(text, model="text-embedding-3-small"):
 
 @timing_decorator
 def store_in_faiss(embeddings):
-    embeddings = np.array(embeddings).astype("float32")
-    embeddings = np.ascontiguousarray(embeddings)
+    # A float32 matrix from get_embeddings is used as-is, without copying
+    embeddings = np.ascontiguousarray(embeddings, dtype="float32")
     faiss.normalize_L2(embeddings)
     dimension = embeddings.shape[1]
     index = faiss.IndexFlatIP(dimension)
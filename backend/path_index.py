@@ -0,0 +1,154 @@
+"""
+Index of the files of a repository, for @file and @dir scoped questions.
+
+Built from the chunk list at indexing time, it maps relative file paths to the
+ids of their chunks, so a scoped question searches the existing FAISS index
+restricted to those ids instead of walking and re-indexing the checkout.
+"""
+
+import bisect
+import difflib
+import os
+
+import numpy as np
+
+FUZZY_CUTOFF = 0.8  # Minimum difflib similarity of a fuzzy basename match
+FUZZY_MAX_LENGTH_DIFFERENCE = 2  # Basenames differing more in length never match
+SCOPE_COMMANDS = ("@file", "@dir")
+SCOPE_NOTE_MAX_PATHS = 5  # Resolved paths listed at the top of a scoped answer
+
+
+def normalize_path(path):
+    path = path.strip().replace("\\", "/")
+    while path.startswith("./"):
+        path = path[2:]
+    return path.strip("/")
+
+
+def parse_scoped_question(question):
+    """
+    Split an `@file <path> <question>` or `@dir <path> <question>` prefix.
+
+    Returns:
+        tuple: (scope, path, question), where scope is "file", "dir" or None.
+
+    Raises:
+        ValueError: If a scope command is missing its path or question.
+    """
+    command = question.split(" ", 1)[0]
+    if command not in SCOPE_COMMANDS:
+        return None, None, question
+    parts = question.split(" ", 2)
+    if len(parts) < 3 or not parts[2].strip():
+        raise ValueError(
+            f"Invalid {command} command format. Expected '{command} <path> <question>'."
+        )
+    return command[1:], normalize_path(parts[1]), parts[2]
+
+
+def describe_scope(paths, max_paths=SCOPE_NOTE_MAX_PATHS):
+    """
+    Markdown line naming the files a scoped question was answered from, so a
+    fuzzy or suffix match that resolved to another file than meant is visible.
+    """
+    shown = ", ".join(f"`{path}`" for path in paths[:max_paths])
+    if len(paths) > max_paths:
+        shown += f" and {len(paths) - max_paths} more files"
+    return f"_Answered from {shown}._\n\n"
+
+
+class PathIndex:
+    """
+    Relative file paths of a repository and the chunk ids of each file.
+
+    Args:
+        file_paths (iterable): File path of every chunk, in chunk id order.
+        repo_path (str, optional): Checkout the paths are made relative to.
+    """
+
+    def __init__(self, file_paths, repo_path=None):
+        self.repo_path = repo_path
+        chunk_ids = {}
+        for chunk_id, file_path in enumerate(file_paths):
+            if repo_path:
+                file_path = os.path.relpath(file_path, repo_path)
+            chunk_ids.setdefault(normalize_path(file_path), []).append(chunk_id)
+        self._chunk_ids = {
+            path: np.array(ids, dtype=np.int64) for path, ids in chunk_ids.items()
+        }
+        self.paths = sorted(self._chunk_ids)
+        self._by_basename = {}
+        for path in self.paths:
+            self._by_basename.setdefault(os.path.basename(path), []).append(path)
+
+    @classmethod
+    def from_chunks(cls, code_chunks, repo_path=None):
+        return cls((chunk[0] for chunk in code_chunks), repo_path)
+
+    def __len__(self):
+        return len(self.paths)
+
+    def find_files(self, query, fuzzy=True):
+        """
+        Resolve a file reference: an exact relative path, a path suffix such as
+        `utils/io.py` or a bare basename, or else the closest fuzzy match.
+
+        Fuzzy matching only corrects small typos in the basename: candidates
+        must be within FUZZY_MAX_LENGTH_DIFFERENCE characters of its length and
+        FUZZY_CUTOFF similar to it, and any directories given must match exactly.
+
+        Returns:
+            list: Matching relative paths, possibly empty.
+        """
+        query = normalize_path(query)
+        if query in self._chunk_ids:
+            return [query]
+        candidates = self._by_basename.get(os.path.basename(query), [])
+        if "/" in query:
+            candidates = [path for path in candidates if path.endswith("/" + query)]
+        if candidates or not fuzzy:
+            return candidates
+
+        directory, basename = os.path.split(query)
+        basenames = difflib.get_close_matches(
+            basename,
+            [
+                name
+                for name in self._by_basename
+                if abs(len(name) - len(basename)) <= FUZZY_MAX_LENGTH_DIFFERENCE
+            ],
+            1,
+            FUZZY_CUTOFF,
+        )
+        paths = [path for name in basenames for path in self._by_basename[name]]
+        if directory:
+            paths = [
+                path
+                for path in paths
+                if f"/{os.path.dirname(path)}".endswith(f"/{directory}")
+            ]
+        return paths
+
+    def find_directory(self, query):
+        """
+        Files under a directory given by its relative path, or by a trailing
+        part of it (e.g. `components` for `src/components`).
+
+        Returns:
+            list: Relative paths of the files under every matching directory.
+        """
+        query = normalize_path(query)
+        if not query:
+            return list(self.paths)
+        prefix = query + "/"
+        start = bisect.bisect_left(self.paths, prefix)
+        end = bisect.bisect_left(self.paths, query + "0")  # "0" sorts right after "/"
+        if start < end:
+            return self.paths[start:end]
+        return [path for path in self.paths if f"/{prefix}" in f"/{path}"]
+
+    def chunk_ids(self, paths):
+        """Ids of the chunks of the given relative paths."""
+        if not paths:
+            return np.empty(0, dtype=np.int64)
+        return np.concatenate([self._chunk_ids[path] for path in paths])
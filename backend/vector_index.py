@@ -0,0 +1,293 @@
+"""
+FAISS index construction for chunk embeddings.
+
+Vectors are L2-normalized and searched by inner product (cosine similarity).
+Exact flat search is used for small repositories; larger ones switch to
+approximate indexes so query latency stays flat as the corpus grows. Run
+`python vector_index.py --help` to compare an index type against exact search.
+"""
+
+import argparse
+import logging
+import math
+import time
+
+import faiss
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# flat:  exact brute-force search
+# ivf:   inverted lists over k-means cells; searches nprobe of nlist cells
+# hnsw:  graph search, no training, best latency at moderate sizes
+# ivfpq: ivf with product-quantized vectors, ~32x less memory than flat, lower recall
+# auto:  pick one of the above from the number of vectors
+INDEX_TYPES = ("auto", "flat", "ivf", "hnsw", "ivfpq")
+DEFAULT_INDEX_TYPE = "auto"
+
+# Corpus sizes at which "auto" moves to the next index type
+AUTO_HNSW_MIN_VECTORS = 20_000
+AUTO_IVF_MIN_VECTORS = 200_000
+AUTO_IVFPQ_MIN_VECTORS = 1_000_000
+
+DEFAULT_NPROBE = 16  # IVF cells searched per query
+HNSW_M = 32  # Graph neighbours per node
+HNSW_EF_CONSTRUCTION = 80
+HNSW_EF_SEARCH = 64
+PQ_BITS = 8  # Bits per product-quantizer code
+PQ_SUBVECTOR_DIMENSIONS = 8  # Dimensions encoded by each PQ code
+IVF_MIN_POINTS_PER_CELL = 39  # Below this faiss k-means training degrades
+HNSW_EXACT_SCOPE_IDS = 4096  # Scoped HNSW searches over fewer ids are exact
+
+
+def resolve_index_type(num_vectors, index_type=DEFAULT_INDEX_TYPE):
+    """Map "auto" to a concrete index type for a corpus of num_vectors."""
+    if index_type not in INDEX_TYPES:
+        raise ValueError(
+            f"Unknown index type '{index_type}'. Expected one of {INDEX_TYPES}"
+        )
+    if index_type != "auto":
+        return index_type
+    if num_vectors >= AUTO_IVFPQ_MIN_VECTORS:
+        return "ivfpq"
+    if num_vectors >= AUTO_IVF_MIN_VECTORS:
+        return "ivf"
+    if num_vectors >= AUTO_HNSW_MIN_VECTORS:
+        return "hnsw"
+    return "flat"
+
+
+def default_nlist(num_vectors):
+    """About 4 * sqrt(n) cells, with enough training points per cell."""
+    nlist = int(4 * math.sqrt(num_vectors))
+    return max(1, min(nlist, num_vectors // IVF_MIN_POINTS_PER_CELL))
+
+
+def build_index(
+    embeddings,
+    index_type=DEFAULT_INDEX_TYPE,
+    nlist=None,
+    nprobe=DEFAULT_NPROBE,
+    hnsw_m=HNSW_M,
+    ef_search=HNSW_EF_SEARCH,
+    pq_m=None,
+):
+    """
+    Build an inner-product index over embeddings. Row i gets id i.
+
+    Args:
+        embeddings (np.ndarray): float32 matrix of shape (n, dimension). It is
+            normalized in place.
+        index_type (str): One of INDEX_TYPES.
+        nlist (int, optional): IVF cells; defaults to default_nlist(n).
+        nprobe (int): IVF cells searched per query.
+        hnsw_m (int): HNSW neighbours per node.
+        ef_search (int): HNSW candidate list size per query.
+        pq_m (int, optional): PQ codes per vector; must divide the dimension.
+
+    Returns:
+        faiss.Index: The populated index.
+    """
+    embeddings = np.ascontiguousarray(embeddings, dtype="float32")
+    faiss.normalize_L2(embeddings)
+    num_vectors, dimension = embeddings.shape
+    index_type = resolve_index_type(num_vectors, index_type)
+    if index_type in ("ivf", "ivfpq") and num_vectors < IVF_MIN_POINTS_PER_CELL:
+        # Too few vectors to train any cells
+        index_type = "flat"
+
+    start_time = time.time()
+    if index_type == "flat":
+        index = faiss.IndexFlatIP(dimension)
+    elif index_type == "hnsw":
+        index = faiss.IndexHNSWFlat(dimension, hnsw_m, faiss.METRIC_INNER_PRODUCT)
+        index.hnsw.efConstruction = HNSW_EF_CONSTRUCTION
+        index.hnsw.efSearch = ef_search
+    else:
+        nlist = nlist or default_nlist(num_vectors)
+        quantizer = faiss.IndexFlatIP(dimension)
+        if index_type == "ivf":
+            index = faiss.IndexIVFFlat(
+                quantizer, dimension, nlist, faiss.METRIC_INNER_PRODUCT
+            )
+        else:
+            pq_m = pq_m or max(1, dimension // PQ_SUBVECTOR_DIMENSIONS)
+            if dimension % pq_m:
+                raise ValueError(f"pq_m={pq_m} does not divide dimension {dimension}")
+            index = faiss.IndexIVFPQ(
+                quantizer, dimension, nlist, pq_m, PQ_BITS, faiss.METRIC_INNER_PRODUCT
+            )
+        index.train(embeddings)
+        index.nprobe = min(nprobe, nlist)
+
+    index.add(embeddings)
+    logger.info(
+        f"Built {index_type} index over {num_vectors} vectors in "
+        f"{time.time() - start_time:.2f} seconds"
+    )
+    return index
+
+
+def is_flat_index(index):
+    """Flat indexes compact ids on remove_ids, so they can be patched in place."""
+    return isinstance(index, faiss.IndexFlat)
+
+
+def search_ids(index, queries, k, ids):
+    """
+    Search only among the vectors whose ids are in ids (e.g. the chunks of one
+    file), without rebuilding anything.
+
+    Args:
+        index (faiss.Index): Index to search.
+        queries (np.ndarray): float32 matrix of normalized query vectors.
+        k (int): Neighbours per query.
+        ids (array-like): Ids the results are restricted to.
+
+    Returns:
+        tuple: (distances, ids) as returned by faiss search; missing results are -1.
+    """
+    ids = np.ascontiguousarray(ids, dtype="int64")
+    concrete = faiss.downcast_index(index)
+    if isinstance(concrete, faiss.IndexHNSW) and len(ids) <= HNSW_EXACT_SCOPE_IDS:
+        # The graph search struggles when few nodes pass the filter; score the
+        # selected vectors exactly instead
+        vectors = concrete.storage.reconstruct_batch(ids)
+        scores = queries @ vectors.T
+        order = np.argsort(-scores, axis=1, kind="stable")[:, :k]
+        distances = np.full((len(queries), k), -np.inf, dtype="float32")
+        labels = np.full((len(queries), k), -1, dtype="int64")
+        distances[:, : order.shape[1]] = np.take_along_axis(scores, order, axis=1)
+        labels[:, : order.shape[1]] = ids[order]
+        return distances, labels
+
+    selector = faiss.IDSelectorBatch(ids)
+    if isinstance(concrete, faiss.IndexIVF):
+        # The selected vectors can sit in any cell, so every cell is scanned
+        params = faiss.SearchParametersIVF(sel=selector, nprobe=concrete.nlist)
+    elif isinstance(concrete, faiss.IndexHNSW):
+        params = faiss.SearchParametersHNSW(
+            sel=selector, efSearch=max(concrete.hnsw.efSearch, k)
+        )
+    else:
+        params = faiss.SearchParameters(sel=selector)
+    return index.search(queries, k, params=params)
+
+
+def index_memory_bytes(index):
+    """Approximate resident size of an index's vectors, lists and graph."""
+    # A downcast view doesn't own the index; keep `index` referenced meanwhile
+    concrete = faiss.downcast_index(index)
+    if isinstance(concrete, faiss.IndexFlat):
+        return concrete.ntotal * concrete.code_size
+    if isinstance(concrete, faiss.IndexIVF):
+        # Codes and int64 ids in the inverted lists, plus the coarse centroids
+        return concrete.ntotal * (concrete.code_size + 8) + index_memory_bytes(
+            concrete.quantizer
+        )
+    if isinstance(concrete, faiss.IndexHNSW):
+        return index_memory_bytes(concrete.storage) + concrete.hnsw.neighbors.size() * 4
+    return index.ntotal * index.d * 4
+
+
+def evaluate_index(index, embeddings, k=10, num_queries=200, noise=0.01, seed=0):
+    """
+    Compare index against exact search on perturbed copies of stored vectors.
+
+    Args:
+        index (faiss.Index): Index built from embeddings.
+        embeddings (np.ndarray): The (normalized) vectors the index holds.
+        k (int): Neighbours per query.
+        num_queries (int): Queries sampled from the corpus.
+        noise (float): Std-dev of the Gaussian noise added to each query.
+
+    Returns:
+        dict: recall@k and mean per-query latency (ms) of both indexes.
+    """
+    embeddings = np.ascontiguousarray(embeddings, dtype="float32")
+    rng = np.random.default_rng(seed)
+    rows = rng.choice(len(embeddings), size=min(num_queries, len(embeddings)))
+    queries = embeddings[rows] + rng.normal(
+        scale=noise, size=(len(rows), embeddings.shape[1])
+    ).astype("float32")
+    faiss.normalize_L2(queries)
+
+    flat = faiss.IndexFlatIP(embeddings.shape[1])
+    flat.add(embeddings)
+
+    def timed_search(search_index):
+        # One query at a time, like query_codebase
+        results = []
+        start_time = time.perf_counter()
+        for query in queries:
+            _, ids = search_index.search(query[None, :], k)
+            results.append(ids[0])
+        return results, (time.perf_counter() - start_time) * 1000 / len(queries)
+
+    exact_ids, flat_ms = timed_search(flat)
+    approx_ids, index_ms = timed_search(index)
+    hits = sum(
+        len(set(exact[exact >= 0]) & set(approx[approx >= 0]))
+        for exact, approx in zip(exact_ids, approx_ids)
+    )
+    return {
+        "vectors": len(embeddings),
+        "k": k,
+        "recall": hits / (len(queries) * min(k, len(embeddings))),
+        "flat_ms": flat_ms,
+        "index_ms": index_ms,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Report recall and latency of an index type against flat search"
+    )
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument("--npy", help="float32 matrix saved with np.save")
+    source.add_argument("--model", help="Embedding model to read from the cache")
+    source.add_argument("--random", type=int, help="Number of synthetic vectors")
+    parser.add_argument("--db-file", default="embedding_cache.db")
+    parser.add_argument("--dimension", type=int, default=1536)
+    parser.add_argument("--index-type", choices=INDEX_TYPES, default="auto")
+    parser.add_argument("--nlist", type=int)
+    parser.add_argument("--nprobe", type=int, default=DEFAULT_NPROBE)
+    parser.add_argument("--ef-search", type=int, default=HNSW_EF_SEARCH)
+    parser.add_argument("-k", type=int, default=10)
+    parser.add_argument("--queries", type=int, default=200)
+    args = parser.parse_args()
+
+    if args.npy:
+        embeddings = np.load(args.npy).astype("float32")
+    elif args.model:
+        from embedding_cache import export_embeddings
+
+        embeddings = export_embeddings(args.db_file, args.model, args.dimension)
+    else:
+        # Clustered data, closer to real embeddings than uniform noise
+        rng = np.random.default_rng(0)
+        centers = rng.normal(size=(max(1, args.random // 100), args.dimension))
+        embeddings = centers[rng.integers(len(centers), size=args.random)]
+        embeddings = (embeddings + rng.normal(scale=0.5, size=embeddings.shape)).astype(
+            "float32"
+        )
+
+    index = build_index(
+        embeddings,
+        args.index_type,
+        nlist=args.nlist,
+        nprobe=args.nprobe,
+        ef_search=args.ef_search,
+    )
+    report = evaluate_index(index, embeddings, k=args.k, num_queries=args.queries)
+    print(
+        f"{resolve_index_type(len(embeddings), args.index_type)}: "
+        f"recall@{report['k']}={report['recall']:.3f} "
+        f"latency={report['index_ms']:.3f} ms (flat {report['flat_ms']:.3f} ms) "
+        f"over {report['vectors']} vectors"
+    )
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    main()